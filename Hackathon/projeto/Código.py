@@ -1,43 +1,537 @@
+import numpy as np
 import pandas as pd
-import googlemaps
 import requests
 import os
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import unicodedata
+import csv
+import sys
+import argparse
+import threading
+import heapq
+import itertools
+import functools
+import atexit
+from contextlib import contextmanager, redirect_stdout
+from collections import Counter, OrderedDict, deque
+from requests.adapters import HTTPAdapter
+from bisect import bisect_left, bisect_right
 from dotenv import load_dotenv
 from openpyxl import load_workbook
 from openpyxl import Workbook
+try:
+    import fcntl  # Trava de arquivos entre processos (Linux/macOS)
+except ImportError:
+    fcntl = None
+    import msvcrt  # Equivalente no Windows
 
 # Carrega as variáveis de ambiente do arquivo .env-------------------------------------------
 load_dotenv()
 
 # Obtém a chave da API do Google Maps.-----------------------------------------------------------
 API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
-gmaps = googlemaps.Client(key=API_KEY)
+
+# Arquivos de persistência: o snapshot completo em Excel e o journal de alterações------------------
+ARQUIVO_DADOS = 'banco de dados.xlsx'
+ARQUIVO_JOURNAL = 'banco de dados.journal'
+LIMITE_JOURNAL = 1000  # Quantidade de alterações no journal antes de compactar no snapshot
+TAMANHO_PAGINA = 50  # Linhas por página nas listagens
+
+# Armazenamento usado pelo sistema: 'excel' (snapshot + journal) ou 'sqlite'---------------------
+ARMAZENAMENTO = os.getenv('ARMAZENAMENTO', 'excel')
+ARQUIVO_SQLITE = 'banco de dados.sqlite'
+TENTATIVAS_RECARGA = 3  # Vezes que uma operação de balcão é tentada quando outro processo compactou o banco
+
+# Endereço da API Distance Matrix (pode apontar para um servidor local em testes)--------------------
+URL_DISTANCE_MATRIX = os.getenv('DISTANCE_MATRIX_URL', 'https://maps.googleapis.com/maps/api/distancematrix/json')
+
+# Parâmetros de rede do cliente da API de distâncias (segundos e número de tentativas)------------
+TIMEOUT_CONEXAO = 3.05
+TIMEOUT_LEITURA = 10
+TENTATIVAS_DISTANCIA = 3
+ESPERA_BASE_DISTANCIA = 0.5
+ESPERA_MAXIMA_DISTANCIA = 8
+
+# Estimativa local de distâncias: arquivo com as coordenadas das cidades e fator de correção de rota
+ARQUIVO_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+FATOR_ROTA = float(os.getenv('FATOR_ROTA', 1.3))  # Distância por estrada / distância em linha reta
+RAIO_TERRA_KM = 6371.0088
+
+# Cache de distâncias: arquivo em disco, tamanho máximo em memória e validade das entradas--------
+ARQUIVO_CACHE_DISTANCIAS = 'cache de distancias.sqlite'
+CAPACIDADE_CACHE_DISTANCIAS = 10000
+VALIDADE_CACHE_DISTANCIAS = 30 * 24 * 60 * 60  # 30 dias, em segundos
+
+# Instrumentação: tempos e contadores das operações principais (INSTRUMENTACAO=1 para ligar)------
+INSTRUMENTACAO = os.getenv('INSTRUMENTACAO', '0') == '1'
+ARQUIVO_INSTRUMENTACAO = os.getenv('ARQUIVO_INSTRUMENTACAO', 'instrumentacao.json')
+
+# Definição da classe instrumentação
+# Acumula, por nome, quantas vezes cada operação rodou e quanto tempo levou (total, máximo e as
+# últimas durações, para os percentis), além de contadores livres como bytes gravados e chamadas
+# à API de distâncias. Desligada, cada ponto instrumentado custa só a verificação de `ativa`.
+class Instrumentacao:
+    def __init__(self, ativa=INSTRUMENTACAO, amostras=10000):
+        self.ativa = ativa
+        self.amostras = amostras
+        self._trava = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._trava:
+            self.tempos = {}  # nome -> [chamadas, total em segundos, máximo, últimas durações]
+            self.contadores = Counter()
+
+    def registrar_tempo(self, nome, duracao):
+        with self._trava:
+            tempo = self.tempos.get(nome)
+            if tempo is None:
+                tempo = self.tempos[nome] = [0, 0.0, 0.0, deque(maxlen=self.amostras)]
+            tempo[0] += 1
+            tempo[1] += duracao
+            tempo[2] = max(tempo[2], duracao)
+            tempo[3].append(duracao)
+
+    def contar(self, nome, quantidade=1):
+        if self.ativa:
+            with self._trava:
+                self.contadores[nome] += quantidade
+
+    # Mede o tempo de um bloco de código
+    @contextmanager
+    def medir(self, nome):
+        if not self.ativa:
+            yield
+            return
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_tempo(nome, time.perf_counter() - inicio)
+
+    def resumo(self):
+        with self._trava:
+            tempos = {}
+            for nome, (chamadas, total, maximo, duracoes) in self.tempos.items():
+                percentis = np.percentile(np.array(duracoes), (50, 95, 99)) * 1000
+                tempos[nome] = {'chamadas': chamadas, 'total_s': total, 'media_ms': total / chamadas * 1000,
+                                'p50_ms': float(percentis[0]), 'p95_ms': float(percentis[1]),
+                                'p99_ms': float(percentis[2]), 'max_ms': maximo * 1000}
+            return {'tempos': tempos, 'contadores': dict(self.contadores)}
+
+    def exibir(self):
+        resumo = self.resumo()
+        if resumo['tempos']:
+            df_tempos = pd.DataFrame.from_dict(resumo['tempos'], orient='index').sort_values('total_s', ascending=False)
+            print("\nTempos por operação:")
+            print(df_tempos.round(3).to_string())
+        if resumo['contadores']:
+            print("\nContadores:")
+            for nome, valor in sorted(resumo['contadores'].items()):
+                print(f"{nome}: {valor}")
+
+    def gravar(self, caminho=ARQUIVO_INSTRUMENTACAO):
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            json.dump(self.resumo(), arquivo, ensure_ascii=False, indent=2)
+
+# Inicializa a instrumentação; ligada, o resumo é gravado em JSON ao encerrar o programa
+instrumentacao = Instrumentacao()
+if instrumentacao.ativa:
+    atexit.register(instrumentacao.gravar, ARQUIVO_INSTRUMENTACAO)
+
+# Decorador que mede o tempo de cada chamada da função quando a instrumentação está ligada
+def instrumentado(funcao):
+    @functools.wraps(funcao)
+    def medida(*args, **kwargs):
+        if not instrumentacao.ativa:
+            return funcao(*args, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            instrumentacao.registrar_tempo(funcao.__name__, time.perf_counter() - inicio)
+    return medida
+
+# Definição da classe cache de distâncias
+# Guarda as distâncias já consultadas por (origem, destino, modo) em dois níveis: um LRU em
+# memória com tamanho máximo e uma tabela SQLite em disco que sobrevive a reinícios.
+class CacheDistancias:
+    def __init__(self, arquivo=None, capacidade=CAPACIDADE_CACHE_DISTANCIAS, validade=VALIDADE_CACHE_DISTANCIAS):
+        self.arquivo = arquivo
+        self.capacidade = capacidade
+        self.validade = validade
+        self.memoria = OrderedDict()  # chave -> (distancia_km, expira_em)
+        self._conexao = None
+        self._trava = threading.RLock()  # O cache é compartilhado pelas threads das consultas assíncronas
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.falhas = 0
+
+    @staticmethod
+    def normalizar(origem, destino, modo='driving'):
+        return tuple(' '.join(str(valor).split()).lower() for valor in (origem, destino, modo))
+
+    def _disco(self):
+        # A conexão só é aberta no primeiro uso do cache
+        if self._conexao is None and self.arquivo:
+            self._conexao = sqlite3.connect(self.arquivo, check_same_thread=False)
+            self._conexao.execute("""CREATE TABLE IF NOT EXISTS distancias (
+                origem TEXT, destino TEXT, modo TEXT, distancia_km REAL, expira_em REAL,
+                PRIMARY KEY (origem, destino, modo))""")
+        return self._conexao
+
+    def _guardar_memoria(self, chave, distancia_km, expira_em):
+        self.memoria[chave] = (distancia_km, expira_em)
+        self.memoria.move_to_end(chave)
+        while len(self.memoria) > self.capacidade:
+            self.memoria.popitem(last=False)
+
+    def obter(self, origem, destino, modo='driving'):
+        with self._trava:
+            chave = self.normalizar(origem, destino, modo)
+            agora = time.time()
+
+            entrada = self.memoria.get(chave)
+            if entrada is not None:
+                if entrada[1] > agora:
+                    self.memoria.move_to_end(chave)
+                    self.acertos_memoria += 1
+                    return entrada[0]
+                del self.memoria[chave]
+
+            conexao = self._disco()
+            if conexao is not None:
+                linha = conexao.execute(
+                    "SELECT distancia_km, expira_em FROM distancias WHERE origem = ? AND destino = ? AND modo = ?",
+                    chave).fetchone()
+                if linha is not None and linha[1] > agora:
+                    self._guardar_memoria(chave, linha[0], linha[1])
+                    self.acertos_disco += 1
+                    return linha[0]
+
+            self.falhas += 1
+            return None
+
+    def guardar(self, origem, destino, distancia_km, modo='driving'):
+        with self._trava:
+            chave = self.normalizar(origem, destino, modo)
+            expira_em = time.time() + self.validade
+            self._guardar_memoria(chave, distancia_km, expira_em)
+
+            conexao = self._disco()
+            if conexao is not None:
+                with conexao:
+                    conexao.execute("INSERT OR REPLACE INTO distancias VALUES (?, ?, ?, ?, ?)",
+                                    chave + (distancia_km, expira_em))
+
+    def remover_expirados(self):
+        with self._trava:
+            agora = time.time()
+            for chave in [c for c, (_, expira_em) in self.memoria.items() if expira_em <= agora]:
+                del self.memoria[chave]
+            conexao = self._disco()
+            if conexao is not None:
+                with conexao:
+                    conexao.execute("DELETE FROM distancias WHERE expira_em <= ?", (agora,))
+
+    def estatisticas(self):
+        consultas = self.acertos_memoria + self.acertos_disco + self.falhas
+        return {
+            'acertos_memoria': self.acertos_memoria,
+            'acertos_disco': self.acertos_disco,
+            'falhas': self.falhas,
+            'taxa_acerto': (self.acertos_memoria + self.acertos_disco) / consultas if consultas else 0.0,
+            'entradas_memoria': len(self.memoria)
+        }
+
+# Inicializa o cache de distâncias
+cache_distancias = CacheDistancias(ARQUIVO_CACHE_DISTANCIAS)
+
+# Erro transitório da API de distâncias (vale a pena tentar de novo)
+class ErroTransitorioDistancia(Exception):
+    pass
+
+# Definição da classe cliente HTTP da API de distâncias
+# Reaproveita conexões (keep-alive) com uma sessão e um pool, aplica timeouts de conexão e de
+# leitura e repete falhas transitórias com espera exponencial e jitter. As latências das
+# chamadas ficam registradas para medir os percentis.
+class ClienteDistancia:
+    STATUS_TRANSITORIOS = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+    def __init__(self, url=None, timeout_conexao=TIMEOUT_CONEXAO, timeout_leitura=TIMEOUT_LEITURA,
+                 tentativas=TENTATIVAS_DISTANCIA, espera_base=ESPERA_BASE_DISTANCIA,
+                 espera_maxima=ESPERA_MAXIMA_DISTANCIA, tamanho_pool=10):
+        self.url = url or URL_DISTANCE_MATRIX
+        self.timeout = (timeout_conexao, timeout_leitura)
+        self.tentativas = tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.latencias = deque(maxlen=10000)
+
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+        self.sessao.mount('https://', adaptador)
+        self.sessao.mount('http://', adaptador)
+
+    def _requisitar(self, parametros):
+        inicio = time.perf_counter()
+        try:
+            resposta = self.sessao.get(self.url, params=parametros, timeout=self.timeout)
+        except Exception:
+            instrumentacao.contar('api_distancias.erros')
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            self.latencias.append(duracao)
+            if instrumentacao.ativa:
+                instrumentacao.registrar_tempo('api_distancias', duracao)
+                instrumentacao.contar('api_distancias.chamadas')
+        if resposta.status_code == 429 or resposta.status_code >= 500:
+            instrumentacao.contar('api_distancias.erros')
+            raise ErroTransitorioDistancia(f"HTTP {resposta.status_code}")
+        dados = resposta.json()
+        if dados.get('status') in self.STATUS_TRANSITORIOS:
+            instrumentacao.contar('api_distancias.erros')
+            raise ErroTransitorioDistancia(dados.get('error_message', dados['status']))
+        return dados
+
+    def consultar(self, origens, destinos, chave_api, modo='driving'):
+        parametros = {
+            "origins": '|'.join(origens),
+            "destinations": '|'.join(destinos),
+            "key": chave_api,
+            "mode": modo,
+            "language": "pt-BR",
+            "units": "metric"
+        }
+        for tentativa in range(self.tentativas):
+            try:
+                return self._requisitar(parametros)
+            except (requests.ConnectionError, requests.Timeout, ErroTransitorioDistancia):
+                if tentativa == self.tentativas - 1:
+                    raise
+                # Espera exponencial com jitter completo, para não sincronizar as novas tentativas
+                time.sleep(random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** tentativa)))
+
+    # Variante assíncrona: a chamada bloqueante roda em uma thread, então várias consultas
+    # podem ficar em andamento ao mesmo tempo dentro de um loop asyncio
+    async def consultar_async(self, origens, destinos, chave_api, modo='driving'):
+        return await asyncio.to_thread(self.consultar, origens, destinos, chave_api, modo)
+
+    def percentis(self, valores=(50, 95, 99)):
+        if not self.latencias:
+            return {}
+        amostras = np.array(self.latencias)
+        return {f'p{p}': float(np.percentile(amostras, p)) for p in valores}
+
+# Inicializa o cliente da API de distâncias
+cliente_distancia = ClienteDistancia()
+
+# Limites da API Distance Matrix por requisição---------------------------------------------------
+MAX_ORIGENS_POR_REQUISICAO = 25
+MAX_DESTINOS_POR_REQUISICAO = 25
+MAX_ELEMENTOS_POR_REQUISICAO = 100
+
+# Função que faz uma requisição à API Distance Matrix com várias origens e destinos
+def consultar_distance_matrix(origens, destinos, chave_api, modo='driving'):
+    return cliente_distancia.consultar(origens, destinos, chave_api, modo)
 
 # Função para calculo da distância e do custo da viagem usando a API do Google Maps----------------
-def calcular_distancia_e_custo(origem, destino, chave_api, taxa_por_km=0.50):
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    parametros = {
-        "origins": origem,
-        "destinations": destino,
-        "key": chave_api,
-        "mode": "driving",  
-        "language": "pt-BR",  
-        "units": "metric"  
-    }
+@instrumentado
+def calcular_distancia_e_custo(origem, destino, chave_api, taxa_por_km=0.50, modo='driving'):
+    # Rotas já consultadas são respondidas pelo cache, sem acessar a rede
+    distancia_km = cache_distancias.obter(origem, destino, modo)
+    if distancia_km is not None:
+        instrumentacao.contar('distancias.cache')
+        return distancia_km, distancia_km * taxa_por_km
 
-    resposta = requests.get(url, params=parametros)
-    dados = resposta.json()
+    dados = consultar_distance_matrix([origem], [destino], chave_api, modo)
 
     if dados["status"] == "OK":
         distancia_metros = dados["rows"][0]["elements"][0]["distance"]["value"]
         distancia_km = distancia_metros / 1000  
         custo = distancia_km * taxa_por_km  
+        cache_distancias.guardar(origem, destino, distancia_km, modo)
         return distancia_km, custo
     else:
-        raise Exception(f"Erro na API do Google Maps: {dados['error_message']}")
+        raise Exception(f"Erro na API do Google Maps: {dados.get('error_message', dados['status'])}")
+
+# Versão assíncrona de calcular_distancia_e_custo, usando o mesmo cache
+async def calcular_distancia_e_custo_async(origem, destino, chave_api, taxa_por_km=0.50, modo='driving'):
+    distancia_km = cache_distancias.obter(origem, destino, modo)
+    if distancia_km is not None:
+        return distancia_km, distancia_km * taxa_por_km
+
+    dados = await cliente_distancia.consultar_async([origem], [destino], chave_api, modo)
+
+    if dados["status"] == "OK":
+        distancia_km = dados["rows"][0]["elements"][0]["distance"]["value"] / 1000
+        cache_distancias.guardar(origem, destino, distancia_km, modo)
+        return distancia_km, distancia_km * taxa_por_km
+    else:
+        raise Exception(f"Erro na API do Google Maps: {dados.get('error_message', dados['status'])}")
+
+# Calcula vários trechos em paralelo, com no máximo `concorrencia` requisições em andamento.
+# Retorna, na ordem dos pares, (distancia_km, custo) ou a exceção do trecho.
+async def calcular_distancias_async(pares, chave_api, taxa_por_km=0.50, modo='driving', concorrencia=10):
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def calcular(origem, destino):
+        async with semaforo:
+            return await calcular_distancia_e_custo_async(origem, destino, chave_api, taxa_por_km, modo)
+
+    return await asyncio.gather(*(calcular(o, d) for o, d in pares), return_exceptions=True)
+
+# Definição da classe estimador de distâncias
+# Calcula a distância sem acessar a rede: as origens e destinos são resolvidos em coordenadas
+# pelo gazetteer local (ou informados diretamente como "latitude,longitude") e a distância é a
+# de haversine multiplicada pelo fator de rota. O cálculo é vetorizado para muitos pares.
+class EstimadorDistancia:
+    def __init__(self, arquivo=ARQUIVO_GAZETTEER, fator_rota=FATOR_ROTA):
+        self.arquivo = arquivo
+        self.fator_rota = fator_rota
+        self._coordenadas = None
+
+    @staticmethod
+    def normalizar(local):
+        texto = unicodedata.normalize('NFKD', str(local)).encode('ascii', 'ignore').decode()
+        return ' '.join(texto.lower().split())
+
+    def coordenadas(self):
+        # O gazetteer só é lido na primeira consulta
+        if self._coordenadas is None:
+            df = pd.read_csv(self.arquivo, encoding='utf-8')
+            self._coordenadas = {self.normalizar(nome): (lat, lon)
+                                 for nome, lat, lon in zip(df['nome'], df['latitude'], df['longitude'])}
+        return self._coordenadas
+
+    def resolver(self, local):
+        partes = str(local).split(',')
+        if len(partes) == 2:
+            try:
+                return float(partes[0]), float(partes[1])
+            except ValueError:
+                pass
+        coordenadas = self.coordenadas()
+        # Aceita também "Cidade, UF" ou "Endereço, Cidade, UF": tenta cada trecho separado por vírgula
+        for trecho in [local] + partes:
+            encontrado = coordenadas.get(self.normalizar(trecho))
+            if encontrado is not None:
+                return encontrado
+        return None
+
+    # Distâncias estimadas (km) para listas de origens e destinos; NaN quando um local não é encontrado
+    def estimar(self, origens, destinos):
+        pontos = [self.resolver(local) for local in list(origens) + list(destinos)]
+        pontos = np.array([p if p is not None else (np.nan, np.nan) for p in pontos], dtype=np.float64).reshape(-1, 2)
+        n = len(origens)
+        lat1, lon1 = np.radians(pontos[:n, 0]), np.radians(pontos[:n, 1])
+        lat2, lon2 = np.radians(pontos[n:, 0]), np.radians(pontos[n:, 1])
+
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(a)) * self.fator_rota
+
+# Inicializa o estimador de distâncias
+estimador_distancia = EstimadorDistancia()
+
+# Função para estimar a distância e o custo sem acessar a API (cotação preliminar)
+def estimar_distancia_e_custo(origem, destino, taxa_por_km=0.50):
+    distancia_km = float(estimador_distancia.estimar([origem], [destino])[0])
+    if np.isnan(distancia_km):
+        raise ValueError(f"Não foi possível localizar '{origem}' ou '{destino}' no gazetteer")
+    return distancia_km, distancia_km * taxa_por_km
+
+# Agrupa os pares pendentes em requisições dentro dos limites da API.
+# Cada grupo é (origens, destinos); a matriz consultada é o produto das duas listas.
+def _agrupar_requisicoes(pares):
+    destinos_por_origem = OrderedDict()
+    for origem, destino in pares:
+        destinos = destinos_por_origem.setdefault(origem, [])
+        if destino not in destinos:
+            destinos.append(destino)
+
+    # Uma origem com muitos destinos é dividida em blocos que cabem sozinhos em uma requisição
+    limite_destinos = min(MAX_DESTINOS_POR_REQUISICAO, MAX_ELEMENTOS_POR_REQUISICAO)
+    blocos = [(origem, destinos[i:i + limite_destinos])
+              for origem, destinos in destinos_por_origem.items()
+              for i in range(0, len(destinos), limite_destinos)]
+
+    # Os blocos são encaixados no grupo atual enquanto a matriz couber; senão um novo grupo é aberto
+    grupos = []
+    for origem, destinos in blocos:
+        if grupos:
+            origens_grupo, destinos_grupo = grupos[-1]
+            uniao = destinos_grupo + [d for d in destinos if d not in destinos_grupo]
+            if (origem not in origens_grupo and len(origens_grupo) < MAX_ORIGENS_POR_REQUISICAO
+                    and len(uniao) <= MAX_DESTINOS_POR_REQUISICAO
+                    and (len(origens_grupo) + 1) * len(uniao) <= MAX_ELEMENTOS_POR_REQUISICAO):
+                origens_grupo.append(origem)
+                destinos_grupo[:] = uniao
+                continue
+        grupos.append(([origem], list(destinos)))
+    return grupos
+
+# Função para calcular a distância e o custo de vários trechos de uma vez.
+# Retorna, na mesma ordem dos pares, um dicionário com distância e custo ou com o erro do trecho;
+# o erro em um trecho (ou em uma requisição) não interrompe os demais.
+def calcular_distancias_em_lote(pares, chave_api, taxa_por_km=0.50, modo='driving'):
+    distancias = {}
+    erros = {}
+    pendentes = OrderedDict()
+    for origem, destino in pares:
+        if (origem, destino) in distancias or (origem, destino) in pendentes:
+            continue
+        distancia_km = cache_distancias.obter(origem, destino, modo)
+        if distancia_km is not None:
+            distancias[(origem, destino)] = distancia_km
+        else:
+            pendentes[(origem, destino)] = True
+
+    for origens, destinos in _agrupar_requisicoes(pendentes):
+        try:
+            dados = consultar_distance_matrix(origens, destinos, chave_api, modo)
+        except Exception as e:
+            dados = {'status': 'ERRO_REQUISICAO', 'error_message': str(e)}
+
+        for i, origem in enumerate(origens):
+            for j, destino in enumerate(destinos):
+                if dados.get('status') != 'OK':
+                    erros[(origem, destino)] = dados.get('error_message', dados.get('status'))
+                    continue
+                elemento = dados['rows'][i]['elements'][j]
+                if elemento.get('status') == 'OK':
+                    distancia_km = elemento['distance']['value'] / 1000
+                    distancias[(origem, destino)] = distancia_km
+                    cache_distancias.guardar(origem, destino, distancia_km, modo)
+                else:
+                    erros[(origem, destino)] = elemento.get('status')
+
+    resultados = []
+    for origem, destino in pares:
+        distancia_km = distancias.get((origem, destino))
+        resultados.append({
+            'origem': origem,
+            'destino': destino,
+            'distancia_km': distancia_km,
+            'custo': distancia_km * taxa_por_km if distancia_km is not None else None,
+            'erro': None if distancia_km is not None else erros.get((origem, destino), 'SEM_RESPOSTA')
+        })
+    return resultados
+
+# Tipo, categoria e status se repetem em milhares de objetos; internados, todos apontam para a mesma string
+def _internar(valor):
+    return sys.intern(valor) if type(valor) is str else valor
 
 # Definição da classe Veículo
+# Usa __slots__ (sem __dict__ por objeto); os campos categóricos são internados ao serem atribuídos.
 class Veiculo:
+    __slots__ = ('modelo', 'marca', '_ano', 'placa', '_tipo', '_categoria', '_status')
+    CAMPOS = ('modelo', 'marca', 'ano', 'placa', 'tipo', 'categoria', 'status')
+
     def __init__(self, modelo, marca, ano, placa, tipo, categoria, status='disponível'):
         self.modelo = modelo
         self.marca = marca
@@ -47,11 +541,58 @@ class Veiculo:
         self.categoria = categoria
         self.status = status
 
+    # O ano chega como texto do menu, da importação e do journal e como número da planilha;
+    # guardado sempre como inteiro (ou None, quando vazio) para que a ordenação por ano funcione
+    @property
+    def ano(self):
+        return self._ano
+
+    @ano.setter
+    def ano(self, valor):
+        if valor is None or valor != valor:
+            self._ano = None
+            return
+        try:
+            self._ano = int(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"Ano inválido: {valor}")
+
+    @property
+    def tipo(self):
+        return self._tipo
+
+    @tipo.setter
+    def tipo(self, valor):
+        self._tipo = _internar(valor)
+
+    @property
+    def categoria(self):
+        return self._categoria
+
+    @categoria.setter
+    def categoria(self, valor):
+        self._categoria = _internar(valor)
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, valor):
+        self._status = _internar(valor)
+
+    # Campos do veículo em um dicionário (para DataFrames e persistência)
+    def para_dict(self):
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+
     def __repr__(self):
         return f"{self.modelo} ({self.placa}) - {self.tipo} - {self.categoria} - {self.status}"
 
 # Definição da classe cliente
 class Cliente:
+    __slots__ = ('nome', 'cpf', 'telefone', 'email', 'pontos_fidelidade')
+    CAMPOS = __slots__
+
     def __init__(self, nome, cpf, telefone, email):
         self.nome = nome
         self.cpf = cpf
@@ -59,6 +600,10 @@ class Cliente:
         self.email = email
         self.pontos_fidelidade = 0  # Inicializa pontos de fidelidade com zero
 
+    # Campos do cliente em um dicionário (para DataFrames e persistência)
+    def para_dict(self):
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+
     def adicionar_pontos(self, pontos):
         self.pontos_fidelidade += pontos
         print(f"{pontos} pontos adicionados. Total de pontos: {self.pontos_fidelidade}")
@@ -73,21 +618,89 @@ class Cliente:
             print("Pontos insuficientes.")
             return 0
 # Definição da classe locação
+# Enquanto a locação não entra no histórico, as datas e a distância ficam no próprio objeto; depois,
+# passam a ser lidas das colunas do histórico (datetime64/float64) e o objeto guarda só a posição.
 class Locacao:
+    __slots__ = ('cliente', 'veiculo', 'taxa_por_km', 'distancia_estimada', '_historico', '_indice',
+                 '_data_retirada', '_data_devolucao_prevista', '_data_devolucao_real', '_distancia_km')
     CATEGORIA_PRECO = {
         'Ferro': 100,
         'Ouro': 150,
         'Premium': 200
     }
     
-    def __init__(self, cliente, veiculo, data_retirada, data_devolucao_prevista, distancia_km=0, taxa_por_km=0.50):
+    def __init__(self, cliente, veiculo, data_retirada, data_devolucao_prevista, distancia_km=0, taxa_por_km=0.50,
+                 distancia_estimada=False):
         self.cliente = cliente
         self.veiculo = veiculo
+        self._historico = None  # Histórico colunar ao qual a locação pertence (se houver)
+        self._indice = None  # Posição da locação nas colunas do histórico
         self.data_retirada = data_retirada
         self.data_devolucao_prevista = data_devolucao_prevista
         self.data_devolucao_real = None  # Inicializa a data de devolução real como None
         self.distancia_km = distancia_km  # Armazena a distância percorrida
         self.taxa_por_km = taxa_por_km  # Armazena a taxa por km para multa
+        self.distancia_estimada = distancia_estimada  # True quando a distância veio do estimador local
+
+    # Passa a ler os dados das colunas do histórico e descarta as cópias locais
+    def _vincular(self, historico, indice):
+        self._historico = historico
+        self._indice = indice
+        self._data_retirada = self._data_devolucao_prevista = self._data_devolucao_real = self._distancia_km = None
+
+    # Copia os dados das colunas de volta para o objeto (quando a locação sai do histórico)
+    def _desvincular(self):
+        dados = (self.data_retirada, self.data_devolucao_prevista, self.data_devolucao_real, self.distancia_km)
+        self._historico = self._indice = None
+        self._data_retirada, self._data_devolucao_prevista, self._data_devolucao_real, self._distancia_km = dados
+
+    def _data_coluna(self, coluna):
+        data = coluna[self._indice]
+        return None if np.isnat(data) else pd.Timestamp(data)
+
+    # Retirada e devolução prevista fazem parte dos índices do histórico e não mudam depois do cadastro
+    @property
+    def data_retirada(self):
+        return self._data_retirada if self._historico is None else self._data_coluna(self._historico.retirada)
+
+    @data_retirada.setter
+    def data_retirada(self, data):
+        if self._historico is not None:
+            raise AttributeError("A data de retirada não pode mudar depois que a locação entra no histórico")
+        self._data_retirada = data
+
+    @property
+    def data_devolucao_prevista(self):
+        return self._data_devolucao_prevista if self._historico is None else self._data_coluna(self._historico.prevista)
+
+    @data_devolucao_prevista.setter
+    def data_devolucao_prevista(self, data):
+        if self._historico is not None:
+            raise AttributeError("A data de devolução prevista não pode mudar depois que a locação entra no histórico")
+        self._data_devolucao_prevista = data
+
+    # A data de devolução real é a única que muda depois do cadastro, por isso é gravada nas colunas do histórico
+    @property
+    def data_devolucao_real(self):
+        return self._data_devolucao_real if self._historico is None else self._data_coluna(self._historico.real)
+
+    @data_devolucao_real.setter
+    def data_devolucao_real(self, data):
+        if self._historico is not None:
+            self._historico.real[self._indice] = _data64(data)
+        else:
+            self._data_devolucao_real = data
+
+    @property
+    def distancia_km(self):
+        return self._distancia_km if self._historico is None else float(self._historico.distancia[self._indice])
+
+    @distancia_km.setter
+    def distancia_km(self, distancia_km):
+        if self._historico is not None:
+            self._historico.distancia[self._indice] = distancia_km
+        else:
+            self._distancia_km = distancia_km
 
     def calcular_preco_total(self, multa=0):
         # Calcula os dias de aluguel
@@ -111,110 +724,902 @@ class Locacao:
         preco_base, total_a_pagar = self.calcular_preco_total()
         pontos = int(total_a_pagar // 10)  # 1 ponto para cada R$10 gastos
         self.cliente.adicionar_pontos(pontos)
+        return pontos
+
+# Converte uma sequência de datas para um vetor datetime64[ns] (None/NaN viram NaT)
+def _datas64(datas):
+    datas = np.asarray(datas)
+    if datas.dtype.kind != 'M':
+        datas = pd.to_datetime(pd.Series(datas, dtype=object)).to_numpy()
+    return datas.astype('datetime64[ns]')
+
+# Precifica um lote de locações com operações vetorizadas do NumPy, seguindo as mesmas regras de
+# Locacao.calcular_preco_total, calcular_multa e acumular_pontos (os resultados são idênticos).
+# Devolve um DataFrame com preco_base, multa, total e pontos, na ordem das entradas.
+def precificar_em_lote(categorias, datas_retirada, datas_prevista, datas_real, distancias_km, taxas_por_km=0.50,
+                       tabela_precos=None):
+    tabela_precos = Locacao.CATEGORIA_PRECO if tabela_precos is None else tabela_precos
+    codigos, unicas = pd.factorize(pd.Series(categorias, dtype=object), use_na_sentinel=False)
+    precos_diarios = np.array([tabela_precos.get(c, 100) for c in unicas])[codigos]
+
+    retirada = _datas64(datas_retirada)
+    prevista = _datas64(datas_prevista)
+    real = _datas64(datas_real)
+    dias_alugados = (prevista - retirada) // np.timedelta64(1, 'D') + 1
+    preco_base = precos_diarios * dias_alugados
+
+    # Multa só quando houve devolução depois da data prevista
+    atrasadas = ~np.isnat(real) & (real > prevista)
+    multa = np.where(atrasadas, np.asarray(distancias_km, dtype=np.float64) * np.asarray(taxas_por_km, dtype=np.float64), 0.0)
+
+    return pd.DataFrame({
+        'preco_base': preco_base,
+        'multa': multa,
+        'total': preco_base + multa,
+        'pontos': (preco_base // 10).astype(np.int64)  # 1 ponto para cada R$10 do preço base
+    })
+
+# Converte uma data (Timestamp, datetime ou None) para datetime64[ns] do NumPy
+def _data64(data):
+    if data is None or pd.isna(data):
+        return np.datetime64('NaT', 'ns')
+    return pd.Timestamp(data).to_datetime64().astype('datetime64[ns]')
 
 # Definição da classe histórico de locações
+# Além da lista de objetos Locacao, o histórico guarda os dados em colunas tipadas do NumPy
+# (códigos inteiros para cliente, veículo, tipo e categoria e datetime64 para as datas),
+# o que permite filtrar milhões de locações com uma única máscara vetorizada.
+# As datas de retirada e de devolução prevista também têm índices ordenados, usados
+# nas consultas por período com busca binária, e cada veículo tem a sua agenda de reservas.
 class HistoricoLocacao:
-    def __init__(self):
+    def __init__(self, capacidade=1024):
         self.locacoes = []
+        # Locações ainda não devolvidas, indexadas por (cpf, placa). Com reservas futuras o mesmo cliente
+        # pode ter mais de uma locação aberta do mesmo veículo, então cada chave guarda uma lista por retirada.
+        self.abertas = {}
+        self.tamanho = 0
+
+        # Tabelas de códigos: posição do cliente/veículo e dos valores categóricos
+        self.clientes = []
+        self.veiculos = []
+        self._codigos_clientes = {}
+        self._codigos_veiculos = {}
+        self.tipos = {}
+        self.categorias = {}
+
+        # Colunas
+        self.cliente = np.empty(capacidade, dtype=np.int32)
+        self.veiculo = np.empty(capacidade, dtype=np.int32)
+        self.tipo = np.empty(capacidade, dtype=np.int16)
+        self.categoria = np.empty(capacidade, dtype=np.int16)
+        self.retirada = np.empty(capacidade, dtype='datetime64[ns]')
+        self.prevista = np.empty(capacidade, dtype='datetime64[ns]')
+        self.real = np.empty(capacidade, dtype='datetime64[ns]')
+        self.distancia = np.empty(capacidade, dtype=np.float64)
+
+        # Índices ordenados: chaves (datas em nanossegundos) e posições correspondentes
+        self._chaves_retirada = []
+        self._posicoes_retirada = []
+        self._chaves_prevista = []
+        self._posicoes_prevista = []
+        self._maior_duracao = 0  # Maior intervalo entre retirada e devolução prevista, em nanossegundos
+
+        # Agenda de cada veículo: código -> (inícios, fins acumulados, posições), ordenada pela retirada.
+        # O fim de uma reserva é a devolução real ou, enquanto ela não ocorre, a prevista; fins acumulados[k]
+        # é o maior fim entre as reservas 0..k, então um período [a, b] está livre quando a última reserva
+        # iniciada até b terminou antes de a (uma busca binária por veículo).
+        self._agenda = {}
+        # Posições das locações abertas de cada veículo (código -> conjunto). Uma locação aberta e atrasada
+        # continua com o cliente, então o fim dela é max(prevista, agora), que muda com o tempo e não cabe na agenda.
+        self._abertas_por_veiculo = {}
+        # Locação por (cpf, placa, retirada em nanossegundos), a chave usada no journal e no banco
+        self._por_chave = {}
+
+        # Protege colunas, índices e abertas quando vários balcões (threads) alteram o histórico
+        self._trava = threading.RLock()
+
+    def _garantir_capacidade(self, quantidade):
+        capacidade = len(self.cliente)
+        if quantidade <= capacidade:
+            return
+        while capacidade < quantidade:
+            capacidade *= 2
+        for nome in ('cliente', 'veiculo', 'tipo', 'categoria', 'retirada', 'prevista', 'real', 'distancia'):
+            antiga = getattr(self, nome)
+            nova = np.empty(capacidade, dtype=antiga.dtype)
+            nova[:self.tamanho] = antiga[:self.tamanho]
+            setattr(self, nome, nova)
 
-    def adicionar_locacao(self, locacao):
+    @staticmethod
+    def _codificar(codigos, tabela, objeto, chave):
+        codigo = codigos.get(chave)
+        if codigo is None:
+            codigo = codigos[chave] = len(codigos)
+            if tabela is not None:
+                tabela.append(objeto)
+        return codigo
+
+    def adicionar_locacao(self, locacao, indexar=True):
+        with self._trava:
+            self._adicionar_locacao(locacao, indexar)
+
+    def _adicionar_locacao(self, locacao, indexar):
+        self._garantir_capacidade(self.tamanho + 1)
+        i = self.tamanho
+        self.cliente[i] = self._codificar(self._codigos_clientes, self.clientes, locacao.cliente, id(locacao.cliente))
+        self.veiculo[i] = self._codificar(self._codigos_veiculos, self.veiculos, locacao.veiculo, id(locacao.veiculo))
+        self.tipo[i] = self._codificar(self.tipos, None, None, str(locacao.veiculo.tipo).lower())
+        self.categoria[i] = self._codificar(self.categorias, None, None, str(locacao.veiculo.categoria).lower())
+        self.retirada[i] = _data64(locacao.data_retirada)
+        self.prevista[i] = _data64(locacao.data_devolucao_prevista)
+        self.real[i] = _data64(locacao.data_devolucao_real)
+        self.distancia[i] = locacao.distancia_km
+        self.tamanho += 1
+        self._por_chave[(locacao.cliente.cpf, locacao.veiculo.placa, int(self.retirada[i].astype(np.int64)))] = locacao
+        if indexar:
+            self._indexar_datas(i)
+            self._agendar(i)
+
+        locacao._vincular(self, i)
         self.locacoes.append(locacao)
+        if locacao.data_devolucao_real is None:
+            self._abrir(locacao)
+
+    def _abrir(self, locacao):
+        abertas = self.abertas.setdefault((locacao.cliente.cpf, locacao.veiculo.placa), [])
+        if locacao not in abertas:
+            abertas.append(locacao)
+            if len(abertas) > 1:
+                abertas.sort(key=lambda l: l.data_retirada)
+        if locacao._historico is self:
+            self._abertas_por_veiculo.setdefault(int(self.veiculo[locacao._indice]), set()).add(locacao._indice)
+
+    def _fechar(self, locacao):
+        chave = (locacao.cliente.cpf, locacao.veiculo.placa)
+        if locacao in self.abertas.get(chave, ()):
+            self.abertas[chave].remove(locacao)
+            if not self.abertas[chave]:
+                del self.abertas[chave]
+        if locacao._historico is self:
+            self._abertas_por_veiculo.get(int(self.veiculo[locacao._indice]), set()).discard(locacao._indice)
+
+    # Carga em lote, coluna a coluna: datas (datetime64[ns]) e distâncias são copiadas direto para as
+    # colunas, e os códigos de cliente, veículo, tipo e categoria saem de uma fatoração vetorizada
+    # (só os objetos distintos passam pelas tabelas de códigos).
+    def adicionar_colunas(self, clientes, veiculos, retiradas, previstas, reais, distancias, taxas, estimadas):
+        with self._trava:
+            inicio, fim = self.tamanho, self.tamanho + len(clientes)
+            self._garantir_capacidade(fim)
+
+            for nome, objetos, codigos, tabela in (('cliente', clientes, self._codigos_clientes, self.clientes),
+                                                   ('veiculo', veiculos, self._codigos_veiculos, self.veiculos)):
+                locais, _ = pd.factorize(np.fromiter(map(id, objetos), dtype=np.int64, count=len(objetos)))
+                _, primeiros = np.unique(locais, return_index=True)
+                distintos = [objetos[p] for p in primeiros]
+                codigos_distintos = np.array([self._codificar(codigos, tabela, o, id(o)) for o in distintos], dtype=np.int32)
+                getattr(self, nome)[inicio:fim] = codigos_distintos[locais] if len(locais) else []
+                if nome == 'veiculo':
+                    tipos = np.array([self._codificar(self.tipos, None, None, str(v.tipo).lower()) for v in distintos],
+                                     dtype=np.int16)
+                    categorias = np.array([self._codificar(self.categorias, None, None, str(v.categoria).lower())
+                                           for v in distintos], dtype=np.int16)
+                    self.tipo[inicio:fim] = tipos[locais] if len(locais) else []
+                    self.categoria[inicio:fim] = categorias[locais] if len(locais) else []
+
+            self.retirada[inicio:fim] = retiradas
+            self.prevista[inicio:fim] = previstas
+            self.real[inicio:fim] = reais
+            self.distancia[inicio:fim] = distancias
+
+            for i, cliente, veiculo, retirada, taxa, estimada in zip(range(inicio, fim), clientes, veiculos,
+                                                                     self.retirada[inicio:fim].astype(np.int64).tolist(),
+                                                                     taxas, estimadas):
+                locacao = Locacao(cliente, veiculo, None, None, taxa_por_km=taxa, distancia_estimada=bool(estimada))
+                locacao._vincular(self, i)
+                self.locacoes.append(locacao)
+                self._por_chave[(cliente.cpf, veiculo.placa, retirada)] = locacao
+            self.tamanho = fim
+            for i in np.flatnonzero(np.isnat(self.real[inicio:fim])):
+                self._abrir(self.locacoes[inicio + i])
+
+            # Em carga em lote é mais barato reordenar tudo de uma vez do que inserir um a um
+            self._reconstruir_indices_datas()
+            self._reconstruir_agenda()
+
+    @staticmethod
+    def _inserir_ordenado(chaves, posicoes, chave, posicao):
+        # Locações novas costumam ter as datas mais recentes, então a inserção quase sempre é no final
+        i = bisect_right(chaves, chave)
+        chaves.insert(i, chave)
+        posicoes.insert(i, posicao)
+
+    def _indexar_datas(self, i):
+        retirada = int(self.retirada[i].astype(np.int64))
+        prevista = int(self.prevista[i].astype(np.int64))
+        self._inserir_ordenado(self._chaves_retirada, self._posicoes_retirada, retirada, i)
+        self._inserir_ordenado(self._chaves_prevista, self._posicoes_prevista, prevista, i)
+        self._maior_duracao = max(self._maior_duracao, prevista - retirada)
+
+    def _reconstruir_indices_datas(self):
+        n = self.tamanho
+        retirada = self.retirada[:n].astype(np.int64)
+        prevista = self.prevista[:n].astype(np.int64)
+        ordem = np.argsort(retirada, kind='stable')
+        self._chaves_retirada = retirada[ordem].tolist()
+        self._posicoes_retirada = ordem.tolist()
+        ordem = np.argsort(prevista, kind='stable')
+        self._chaves_prevista = prevista[ordem].tolist()
+        self._posicoes_prevista = ordem.tolist()
+        self._maior_duracao = int((prevista - retirada).max()) if n else 0
+
+    # Fim da reserva na posição i, em nanossegundos
+    def _fim(self, i):
+        real = self.real[i]
+        return int((self.prevista[i] if np.isnat(real) else real).astype(np.int64))
+
+    # Recalcula os fins acumulados da agenda a partir da reserva k
+    def _acumular_fins(self, fins, posicoes, k):
+        maior = fins[k - 1] if k else None
+        for j in range(k, len(posicoes)):
+            fim = self._fim(posicoes[j])
+            maior = fim if maior is None or fim > maior else maior
+            fins[j] = maior
+
+    def _agendar(self, i):
+        inicios, fins, posicoes = self._agenda.setdefault(int(self.veiculo[i]), ([], [], []))
+        inicio = int(self.retirada[i].astype(np.int64))
+        k = bisect_right(inicios, inicio)
+        inicios.insert(k, inicio)
+        fins.insert(k, 0)
+        posicoes.insert(k, i)
+        self._acumular_fins(fins, posicoes, k)
+
+    def _reconstruir_agenda(self):
+        n = self.tamanho
+        veiculos = self.veiculo[:n]
+        inicios = self.retirada[:n].astype(np.int64)
+        fins = np.where(np.isnat(self.real[:n]), self.prevista[:n], self.real[:n]).astype(np.int64)
+        ordem = np.lexsort((inicios, veiculos))
+        self._agenda = {}
+        for grupo in np.split(ordem, np.flatnonzero(np.diff(veiculos[ordem])) + 1):
+            if len(grupo):
+                self._agenda[int(veiculos[grupo[0]])] = (inicios[grupo].tolist(),
+                                                         np.maximum.accumulate(fins[grupo]).tolist(), grupo.tolist())
+
+    # Verifica se nenhuma reserva do veículo cruza o período [inicio, fim], em O(log k)
+    def veiculo_livre(self, veiculo, inicio, fim):
+        with self._trava:
+            codigo = self._codigos_veiculos.get(id(veiculo))
+            agenda = self._agenda.get(codigo)
+            if agenda is None:
+                return True
+            inicios, fins, _ = agenda
+            inicio = int(_data64(inicio).astype(np.int64))
+            fim = int(_data64(fim).astype(np.int64))
+            k = bisect_right(inicios, fim)
+            if k and fins[k - 1] >= inicio:
+                return False
+            # Locações abertas terminam em max(prevista, agora): se o período começa até agora,
+            # qualquer locação aberta iniciada até o fim do período ainda ocupa o veículo
+            if inicio <= int(_data64(pd.Timestamp.today()).astype(np.int64)):
+                return not any(int(self.retirada[i].astype(np.int64)) <= fim
+                               for i in self._abertas_por_veiculo.get(codigo, ()))
+            return True
+
+    # Remove uma locação do histórico (cancelamento de reserva). As posições seguintes andam uma casa,
+    # então os índices e as agendas são reconstruídos; é O(n), mas cancelamentos são raros.
+    def remover_locacao(self, locacao):
+        with self._trava:
+            self._fechar(locacao)
+            i = locacao._indice
+            n = self.tamanho
+            chave = (locacao.cliente.cpf, locacao.veiculo.placa, int(self.retirada[i].astype(np.int64)))
+            if self._por_chave.get(chave) is locacao:
+                del self._por_chave[chave]
+            # Copia os dados da locação antes que as colunas andem
+            locacao._desvincular()
+            for nome in ('cliente', 'veiculo', 'tipo', 'categoria', 'retirada', 'prevista', 'real', 'distancia'):
+                coluna = getattr(self, nome)
+                coluna[i:n - 1] = coluna[i + 1:n]
+            self.tamanho -= 1
+            del self.locacoes[i]
+            for j in range(i, self.tamanho):
+                self.locacoes[j]._indice = j
+            self._abertas_por_veiculo = {codigo: {p - (p > i) for p in posicoes}
+                                         for codigo, posicoes in self._abertas_por_veiculo.items()}
+            self._reconstruir_indices_datas()
+            self._reconstruir_agenda()
+
+    # Locação pelo cpf do cliente, placa do veículo e data de retirada (ou None)
+    def buscar_locacao(self, cpf, placa, data_retirada):
+        return self._por_chave.get((cpf, placa, int(_data64(data_retirada).astype(np.int64))))
+
+    # Todas as locações do veículo, em ordem de retirada
+    def locacoes_do_veiculo(self, veiculo):
+        with self._trava:
+            agenda = self._agenda.get(self._codigos_veiculos.get(id(veiculo)))
+            return [self.locacoes[i] for i in agenda[2]] if agenda else []
+
+    # Locações abertas do veículo (em andamento ou reservadas), em ordem de retirada
+    def abertas_do_veiculo(self, veiculo):
+        with self._trava:
+            posicoes = self._abertas_por_veiculo.get(self._codigos_veiculos.get(id(veiculo)), ())
+            return [self.locacoes[i] for i in sorted(posicoes, key=lambda i: self.retirada[i])]
+
+    def registrar_devolucao(self, locacao, data_devolucao_real):
+        with self._trava:
+            locacao.data_devolucao_real = data_devolucao_real
+            # A devolução muda o fim da reserva na agenda do veículo
+            i = locacao._indice
+            agenda = self._agenda.get(int(self.veiculo[i])) if locacao._historico is self else None
+            if agenda is not None:
+                inicios, fins, posicoes = agenda
+                k = bisect_left(inicios, int(self.retirada[i].astype(np.int64)))
+                while posicoes[k] != i:
+                    k += 1
+                self._acumular_fins(fins, posicoes, k)
+            if data_devolucao_real is None:
+                self._abrir(locacao)
+            else:
+                self._fechar(locacao)
+
+    # Locação aberta do cliente com o veículo (a de retirada mais antiga, quando houver reservas futuras)
+    def buscar_locacao_aberta(self, cpf, placa):
+        abertas = self.abertas.get((cpf, placa))
+        return abertas[0] if abertas else None
+
+    # Reprecifica todas as locações a partir das colunas (por exemplo, após mudar a tabela de preços ou a taxa por km).
+    # taxa_por_km=None mantém a taxa de cada locação.
+    def reprecificar(self, tabela_precos=None, taxa_por_km=None):
+        with self._trava:
+            n = self.tamanho
+            categorias = np.array([v.categoria for v in self.veiculos], dtype=object)[self.veiculo[:n]]
+            taxas = taxa_por_km if taxa_por_km is not None else np.array([l.taxa_por_km for l in self.locacoes[:n]], dtype=np.float64)
+            return precificar_em_lote(categorias, self.retirada[:n], self.prevista[:n], self.real[:n],
+                                      self.distancia[:n], taxas, tabela_precos)
+
+    def listar_abertas(self):
+        with self._trava:
+            return [locacao for abertas in self.abertas.values() for locacao in abertas]
 
     def listar_historico(self):
         return self.locacoes
 
-# Inicializa o histórico de locações
+    # Posições cuja chave está entre inicio e fim (inclusive); None deixa o limite em aberto
+    @staticmethod
+    def _faixa(chaves, posicoes, inicio=None, fim=None):
+        a = bisect_left(chaves, int(_data64(inicio).astype(np.int64))) if inicio is not None else 0
+        b = bisect_right(chaves, int(_data64(fim).astype(np.int64))) if fim is not None else len(chaves)
+        return np.array(posicoes[a:b], dtype=np.int64)
+
+    # Locações retiradas dentro do período, em O(log n + k)
+    def locacoes_no_periodo(self, inicio=None, fim=None):
+        posicoes = self._faixa(self._chaves_retirada, self._posicoes_retirada, inicio, fim)
+        return [self.locacoes[i] for i in posicoes]
+
+    # Posições das locações cujo intervalo [retirada, devolução prevista] cruza o período.
+    # Só pode cruzar quem foi retirado entre (inicio - maior duração) e fim, então a busca
+    # binária delimita os candidatos e o teste da devolução prevista é feito só sobre eles.
+    def posicoes_sobrepostas(self, inicio=None, fim=None):
+        with self._trava:
+            if inicio is None:
+                return self._faixa(self._chaves_retirada, self._posicoes_retirada, None, fim)
+            inicio = pd.Timestamp(inicio)
+            candidatas = self._faixa(self._chaves_retirada, self._posicoes_retirada,
+                                     inicio - pd.Timedelta(self._maior_duracao, unit='ns'), fim)
+            return candidatas[self.prevista[candidatas] >= _data64(inicio)]
+
+    def locacoes_sobrepostas(self, inicio=None, fim=None):
+        return [self.locacoes[i] for i in self.posicoes_sobrepostas(inicio, fim)]
+
+    # Códigos da tabela cujo valor satisfaz a condição
+    @staticmethod
+    def _codigos_onde(objetos, condicao):
+        return np.array([i for i, objeto in enumerate(objetos) if condicao(objeto)], dtype=np.int32)
+
+    # Retorna as posições das locações que atendem a todos os filtros (máscara vetorizada)
+    def filtrar(self, nome_cliente=None, cpf_cliente=None, placa_veiculo=None, tipo_veiculo=None,
+                categoria_veiculo=None, data_inicio=None, data_fim=None):
+        with self._trava:
+            return self._filtrar(nome_cliente, cpf_cliente, placa_veiculo, tipo_veiculo,
+                                 categoria_veiculo, data_inicio, data_fim)
+
+    def _filtrar(self, nome_cliente, cpf_cliente, placa_veiculo, tipo_veiculo, categoria_veiculo, data_inicio, data_fim):
+        # Os filtros de data usam os índices ordenados para reduzir os candidatos antes da máscara.
+        # Com início e fim, a retirada também fica dentro do período (a retirada vem antes da devolução prevista).
+        if data_inicio:
+            posicoes = self._faixa(self._chaves_retirada, self._posicoes_retirada, data_inicio, data_fim or None)
+            posicoes.sort()
+        elif data_fim:
+            posicoes = self._faixa(self._chaves_prevista, self._posicoes_prevista, None, data_fim)
+            posicoes.sort()
+        else:
+            posicoes = np.arange(self.tamanho)
+        mascara = np.ones(len(posicoes), dtype=bool)
+
+        if nome_cliente:
+            nome = nome_cliente.lower()
+            mascara &= np.isin(self.cliente[posicoes], self._codigos_onde(self.clientes, lambda c: c.nome.lower() == nome))
+        if cpf_cliente:
+            mascara &= np.isin(self.cliente[posicoes], self._codigos_onde(self.clientes, lambda c: c.cpf == cpf_cliente))
+        if placa_veiculo:
+            mascara &= np.isin(self.veiculo[posicoes], self._codigos_onde(self.veiculos, lambda v: v.placa == placa_veiculo))
+        if tipo_veiculo:
+            mascara &= self.tipo[posicoes] == self.tipos.get(tipo_veiculo.lower(), -1)
+        if categoria_veiculo:
+            mascara &= self.categoria[posicoes] == self.categorias.get(categoria_veiculo.lower(), -1)
+        if data_inicio and data_fim:
+            mascara &= self.prevista[posicoes] <= _data64(data_fim)
+
+        return posicoes[mascara]
+
+    # Colunas usadas para ordenar as locações, com os mesmos nomes das linhas de iterar()
+    def _chaves_ordenacao(self, campo, posicoes):
+        if campo == 'Cliente':
+            return np.array([c.nome for c in self.clientes], dtype=object)[self.cliente[posicoes]]
+        if campo in ('Veículo', 'Placa'):
+            atributo = 'modelo' if campo == 'Veículo' else 'placa'
+            return np.array([getattr(v, atributo) for v in self.veiculos], dtype=object)[self.veiculo[posicoes]]
+        colunas = {'Data Retirada': self.retirada, 'Data Devolução Prevista': self.prevista,
+                   'Data Devolução Real': self.real, 'Distância (km)': self.distancia}
+        if campo not in colunas:
+            raise ValueError(f"Campo de ordenação desconhecido: {campo}")
+        return colunas[campo][posicoes]
+
+    # Ordena as posições pelo campo (ordenação estável e vetorizada sobre as colunas)
+    def ordenar(self, posicoes, campo, decrescente=False):
+        with self._trava:
+            ordem = np.argsort(self._chaves_ordenacao(campo, posicoes), kind='stable')
+        return posicoes[ordem[::-1] if decrescente else ordem]
+
+    # Gera as locações (todas ou as posições informadas, na ordem dada) como dicionários, lendo as
+    # colunas em blocos: a memória usada não depende do tamanho do resultado
+    def iterar(self, posicoes=None, tamanho_bloco=1024):
+        if posicoes is None:
+            posicoes = np.arange(self.tamanho)
+        for inicio in range(0, len(posicoes), tamanho_bloco):
+            bloco = posicoes[inicio:inicio + tamanho_bloco]
+            with self._trava:
+                clientes = [self.clientes[c].nome for c in self.cliente[bloco].tolist()]
+                veiculos = [self.veiculos[c] for c in self.veiculo[bloco].tolist()]
+                retiradas = pd.DatetimeIndex(self.retirada[bloco]).tolist()
+                previstas = pd.DatetimeIndex(self.prevista[bloco]).tolist()
+                reais = pd.DatetimeIndex(self.real[bloco]).tolist()
+                distancias = self.distancia[bloco].tolist()
+            for cliente, veiculo, retirada, prevista, real, distancia in zip(
+                    clientes, veiculos, retiradas, previstas, reais, distancias):
+                yield {
+                    'Cliente': cliente,
+                    'Veículo': veiculo.modelo,
+                    'Placa': veiculo.placa,
+                    'Data Retirada': retirada,
+                    'Data Devolução Prevista': prevista,
+                    'Data Devolução Real': None if real is pd.NaT else real,
+                    'Distância (km)': distancia
+                }
+
+# Definição da classe repositório de veículos e clientes, indexados por placa e CPF
+# As operações de balcão são serializadas por exclusivo(); as consultas leem sem trava.
+class Repositorio:
+    def __init__(self):
+        self.veiculos = []
+        self.clientes = []
+        self.veiculos_por_placa = {}
+        self.clientes_por_cpf = {}
+        self._trava = threading.Lock()
+
+    # Com unico=True (cadastros novos) uma placa repetida é recusada: o journal e o SQLite identificam
+    # o veículo pela placa. Dados antigos podem ter repetições; nelas prevalece o primeiro cadastro.
+    def adicionar_veiculo(self, veiculo, unico=False):
+        with self._trava:
+            if unico and veiculo.placa in self.veiculos_por_placa:
+                raise ValueError(f"Placa {veiculo.placa} já cadastrada")
+            self.veiculos.append(veiculo)
+            self.veiculos_por_placa.setdefault(veiculo.placa, veiculo)
+
+    # Idem para o CPF dos clientes
+    def adicionar_cliente(self, cliente, unico=False):
+        with self._trava:
+            if unico and cliente.cpf in self.clientes_por_cpf:
+                raise ValueError(f"CPF {cliente.cpf} já cadastrado")
+            self.clientes.append(cliente)
+            self.clientes_por_cpf.setdefault(cliente.cpf, cliente)
+
+    def buscar_veiculo(self, placa):
+        return self.veiculos_por_placa.get(placa)
+
+    def buscar_cliente(self, cpf):
+        return self.clientes_por_cpf.get(cpf)
+
+    def listar_veiculos(self):
+        return self.veiculos
+
+    def listar_clientes(self):
+        return self.clientes
+
+# Definição da classe agregados da frota
+# Contagens de veículos por status, categoria e tipo e, por dia e por mês, a receita (preço base + multa
+# das locações devolvidas, na data da devolução), as multas e os pontos de fidelidade gerados (na data da
+# retirada). Cada evento (cadastro, troca de status, locação, devolução) atualiza os totais, então os
+# relatórios não percorrem o histórico. Descontos com pontos não entram: não ficam gravados por locação.
+class AgregadosFrota:
+    def __init__(self):
+        self.por_status = Counter()
+        self.por_categoria = Counter()
+        self.por_tipo = Counter()
+        self.diario = {}  # datetime64[D] -> [receita, multas, pontos]
+        self.mensal = {}  # datetime64[M] -> [receita, multas, pontos]
+        self._trava = threading.Lock()
+
+    def _somar(self, dia, receita=0.0, multa=0.0, pontos=0):
+        for tabela, chave in ((self.diario, dia), (self.mensal, dia.astype('datetime64[M]'))):
+            valores = tabela.setdefault(chave, [0.0, 0.0, 0])
+            valores[0] += receita
+            valores[1] += multa
+            valores[2] += pontos
+
+    def registrar_veiculo(self, veiculo):
+        with self._trava:
+            self.por_status[veiculo.status] += 1
+            self.por_categoria[veiculo.categoria] += 1
+            self.por_tipo[veiculo.tipo] += 1
+
+    def retirar_veiculo(self, veiculo):
+        with self._trava:
+            self.por_status[veiculo.status] -= 1
+            self.por_categoria[veiculo.categoria] -= 1
+            self.por_tipo[veiculo.tipo] -= 1
+
+    def alterar_status(self, antigo, novo):
+        with self._trava:
+            self.por_status[antigo] -= 1
+            self.por_status[novo] += 1
+
+    def registrar_pontos(self, data_retirada, pontos):
+        with self._trava:
+            self._somar(_data64(data_retirada).astype('datetime64[D]'), pontos=pontos)
+
+    def registrar_receita(self, data_devolucao, receita, multa):
+        with self._trava:
+            self._somar(_data64(data_devolucao).astype('datetime64[D]'), receita=receita, multa=multa)
+
+    # Soma (sinal=1) ou retira (sinal=-1) a contribuição de uma locação, com os mesmos valores de
+    # construir(): pontos no dia da retirada e, se já devolvida, receita e multa no dia da devolução
+    def registrar_locacao(self, locacao, sinal=1):
+        preco_base, _ = locacao.calcular_preco_total()
+        self.registrar_pontos(locacao.data_retirada, sinal * int(preco_base // 10))
+        if locacao.data_devolucao_real is not None:
+            multa = locacao.calcular_multa()
+            _, total = locacao.calcular_preco_total(multa)
+            self.registrar_receita(locacao.data_devolucao_real, sinal * total, sinal * multa)
+
+    # Totais de um período ('diario' ou 'mensal') em um DataFrame ordenado pela data
+    def receita(self, periodo='mensal'):
+        with self._trava:
+            tabela = sorted((self.diario if periodo == 'diario' else self.mensal).items())
+        return pd.DataFrame([(pd.Timestamp(chave), *valores) for chave, valores in tabela],
+                            columns=['Período', 'Receita', 'Multas', 'Pontos'])
+
+    # Reconstrói os agregados do zero a partir do repositório e das colunas do histórico
+    @classmethod
+    def construir(cls, repositorio, historico):
+        agregados = cls()
+        veiculos = repositorio.listar_veiculos()
+        agregados.por_status.update(v.status for v in veiculos)
+        agregados.por_categoria.update(v.categoria for v in veiculos)
+        agregados.por_tipo.update(v.tipo for v in veiculos)
+
+        n = historico.tamanho
+        if n:
+            precos = historico.reprecificar()
+            retirada = historico.retirada[:n]
+            real = historico.real[:n]
+            devolvidas = ~np.isnat(real)
+
+            pontos = precos['pontos'].groupby(retirada.astype('datetime64[D]')).sum()
+            for dia, valor in zip(pontos.index.to_numpy(), pontos.tolist()):
+                agregados._somar(dia.astype('datetime64[D]'), pontos=valor)
+            receitas = precos.loc[devolvidas, ['total', 'multa']].set_axis(['receita', 'multa'], axis=1) \
+                .groupby(real[devolvidas].astype('datetime64[D]')).sum()
+            for dia, receita, multa in zip(receitas.index.to_numpy(), receitas['receita'].tolist(), receitas['multa'].tolist()):
+                agregados._somar(dia.astype('datetime64[D]'), receita=receita, multa=multa)
+        return agregados
+
+    # Compara com uma reconstrução completa e devolve a lista de divergências (vazia se tudo confere)
+    def conferir(self, repositorio, historico):
+        referencia = self.construir(repositorio, historico)
+        divergencias = []
+        for nome in ('por_status', 'por_categoria', 'por_tipo'):
+            atual, esperado = +getattr(self, nome), +getattr(referencia, nome)
+            if atual != esperado:
+                divergencias.append(f"{nome}: {dict(atual)} != {dict(esperado)}")
+        for nome in ('diario', 'mensal'):
+            atual, esperado = getattr(self, nome), getattr(referencia, nome)
+            for chave in sorted(set(atual) | set(esperado)):
+                a, e = atual.get(chave, [0.0, 0.0, 0]), esperado.get(chave, [0.0, 0.0, 0])
+                if not np.allclose(a, e):
+                    divergencias.append(f"{nome} {chave}: {a} != {e}")
+        return divergencias
+
+# Inicializa o histórico de locações, o repositório e os agregados
 historico = HistoricoLocacao()
+repositorio = Repositorio()
+agregados = AgregadosFrota()
+
+# Consultas em fluxo-------------------------------------------------------------------------------
+# As listagens são geradores de dicionários: a saída começa antes do fim da consulta e a memória
+# usada depende do tamanho da página, não do resultado.
+
+# Ordena (opcionalmente) e recorta uma sequência de registros. Com limite, só os primeiros
+# inicio + limite registros são mantidos em um heap, sem ordenar o resultado inteiro.
+def paginar(registros, ordenar_por=None, decrescente=False, inicio=0, limite=None):
+    if ordenar_por:
+        # Valores vazios vão para o fim, tanto na ordem crescente quanto na decrescente
+        def chave(registro):
+            valor = registro[ordenar_por]
+            return (valor is None, valor) if not decrescente else (valor is not None, valor)
+        if limite is not None:
+            registros = (heapq.nlargest if decrescente else heapq.nsmallest)(inicio + limite, registros, key=chave)
+        else:
+            registros = sorted(registros, key=chave, reverse=decrescente)
+    return itertools.islice(registros, inicio, None if limite is None else inicio + limite)
+
+# Gera os veículos que atendem aos filtros (tipo, status e categoria)
+def iterar_veiculos(tipo=None, status=None, categoria=None, ordenar_por=None, decrescente=False, inicio=0, limite=None):
+    tipo = tipo.lower() if tipo else None
+    status = status.lower() if status else None
+    categoria = categoria.lower() if categoria else None
+    registros = (v.para_dict() for v in repositorio.listar_veiculos()
+                 if (tipo is None or v.tipo.lower() == tipo) and (status is None or v.status.lower() == status)
+                 and (categoria is None or v.categoria.lower() == categoria))
+    return paginar(registros, ordenar_por, decrescente, inicio, limite)
+
+# Gera os clientes cadastrados
+def iterar_clientes(ordenar_por=None, decrescente=False, inicio=0, limite=None):
+    return paginar((c.para_dict() for c in repositorio.listar_clientes()), ordenar_por, decrescente, inicio, limite)
+
+# Gera as locações que atendem aos filtros (ou as posições informadas). A ordenação é feita sobre as
+# colunas do histórico, então só a página pedida vira dicionário.
+def iterar_locacoes(nome_cliente=None, cpf_cliente=None, placa_veiculo=None, tipo_veiculo=None, categoria_veiculo=None,
+                    data_inicio=None, data_fim=None, posicoes=None, ordenar_por=None, decrescente=False, inicio=0, limite=None):
+    if posicoes is None:
+        posicoes = historico.filtrar(nome_cliente, cpf_cliente, placa_veiculo, tipo_veiculo,
+                                     categoria_veiculo, data_inicio, data_fim)
+    if ordenar_por:
+        posicoes = historico.ordenar(posicoes, ordenar_por, decrescente)
+    return historico.iterar(posicoes[inicio:None if limite is None else inicio + limite])
+
+# Imprime os registros página a página; com pausar, pergunta antes de cada nova página.
+# Retorna a quantidade de registros impressos.
+def imprimir_paginas(registros, titulo=None, tamanho_pagina=TAMANHO_PAGINA, pausar=False):
+    registros = iter(registros)
+    impressos = 0
+    while True:
+        pagina = list(itertools.islice(registros, tamanho_pagina))
+        if not pagina:
+            break
+        if impressos == 0 and titulo:
+            print(titulo)
+        print(pd.DataFrame(pagina).to_string(index=False))
+        impressos += len(pagina)
+        if pausar and len(pagina) == tamanho_pagina:
+            if input("Enter para a próxima página ou 'q' para parar: ").strip().lower() == 'q':
+                break
+    return impressos
+
+# Converte valores de um registro para texto/JSON na exportação
+def _valor_exportacao(valor):
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    return _valor_json(valor)
+
+# Grava os registros em CSV ou JSONL (pela extensão do arquivo), um por vez. Retorna a quantidade gravada.
+def exportar_registros(registros, caminho):
+    quantidade = 0
+    if caminho.lower().endswith('.jsonl'):
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            for registro in registros:
+                arquivo.write(json.dumps(registro, ensure_ascii=False, default=_valor_exportacao) + '\n')
+                quantidade += 1
+        return quantidade
+    with open(caminho, 'w', encoding='utf-8', newline='') as arquivo:
+        escritor = None
+        for registro in registros:
+            if escritor is None:
+                escritor = csv.DictWriter(arquivo, fieldnames=list(registro))
+                escritor.writeheader()
+            escritor.writerow({campo: '' if valor is None else valor for campo, valor in registro.items()})
+            quantidade += 1
+    return quantidade
 
 # Função para buscar veículos disponíveis com base no tipo e status
-def buscar_veiculos(tipo=None, status=None, categoria=None):
-    veiculos_filtrados = veiculos
-    
-    if tipo:
-        veiculos_filtrados = [v for v in veiculos_filtrados if v.tipo.lower() == tipo.lower()]
-    if status:
-        veiculos_filtrados = [v for v in veiculos_filtrados if v.status.lower() == status.lower()]
-    if categoria:
-        veiculos_filtrados = [v for v in veiculos_filtrados if v.categoria.lower() == categoria.lower()]
-
-    if veiculos_filtrados:
-        df_veiculos_filtrados = pd.DataFrame([vars(v) for v in veiculos_filtrados])
-        print("\nResultados da Busca de Veículos:")
-        print(df_veiculos_filtrados.to_string(index=False))
-    else:
+@instrumentado
+def buscar_veiculos(tipo=None, status=None, categoria=None, ordenar_por=None, decrescente=False, inicio=0, limite=None,
+                    pausar=False):
+    registros = iterar_veiculos(tipo, status, categoria, ordenar_por, decrescente, inicio, limite)
+    if not imprimir_paginas(registros, "\nResultados da Busca de Veículos:", pausar=pausar):
         print("Nenhum veículo encontrado com os filtros fornecidos.")
         
+# Chave de um veículo, cliente ou locação registrado nos dados em memória (None para os demais argumentos)
+def _chave_registro(objeto):
+    if isinstance(objeto, Veiculo) and repositorio.buscar_veiculo(objeto.placa) is objeto:
+        return objeto.placa
+    if isinstance(objeto, Cliente) and repositorio.buscar_cliente(objeto.cpf) is objeto:
+        return objeto.cpf
+    if isinstance(objeto, Locacao) and objeto._historico is historico:
+        return objeto.cliente.cpf, objeto.veiculo.placa, objeto.data_retirada
+    return None
+
+# Objeto equivalente, nos dados recarregados, ao que tinha a chave informada
+def _reencontrar(objeto, chave):
+    if chave is None:
+        return objeto
+    if isinstance(objeto, Veiculo):
+        novo = repositorio.buscar_veiculo(chave)
+    elif isinstance(objeto, Cliente):
+        novo = repositorio.buscar_cliente(chave)
+    else:
+        novo = historico.buscar_locacao(*chave)
+    if novo is None:
+        raise ValueError("Registro não encontrado depois de recarregar os dados")
+    return novo
+
+# Decorador das operações de balcão: quando a operação é recusada com ErroConcorrencia (por exemplo,
+# outro processo compactou o banco), nada dela foi gravado; os dados são recarregados e a operação se
+# repete com os objetos recarregados equivalentes aos recebidos. Dentro de uma seção já aberta
+# (uma importação), o erro sobe para quem a abriu.
+def repetir_apos_recarga(funcao):
+    @functools.wraps(funcao)
+    def repetida(*args, **kwargs):
+        if armazenamento.em_secao():
+            return funcao(*args, **kwargs)
+        for tentativa in range(1, TENTATIVAS_RECARGA + 1):
+            # As chaves são tiradas antes: uma tentativa recusada no meio pode ter mexido na memória
+            chaves = [_chave_registro(arg) for arg in args]
+            try:
+                return funcao(*args, **kwargs)
+            except ErroConcorrencia as e:
+                if tentativa == TENTATIVAS_RECARGA:
+                    raise
+                print(f"{e}. Recarregando os dados e repetindo a operação...")
+                carregar_dados()
+                instrumentacao.contar('recargas')
+                args = [_reencontrar(arg, chave) for arg, chave in zip(args, chaves)]
+    return repetida
+
+# Função para adicionar um cliente
+@repetir_apos_recarga
+def adicionar_cliente(cliente):
+    with exclusivo():
+        repositorio.adicionar_cliente(cliente, unico=True)
+        salvar_cliente(cliente)
+
 # Função para adicionar um veículo à lista de veículos
+@repetir_apos_recarga
 def adicionar_veiculo(veiculo):
-    veiculos.append(veiculo)
-    salvar_dados()
+    with exclusivo():
+        repositorio.adicionar_veiculo(veiculo, unico=True)
+        agregados.registrar_veiculo(veiculo)
+        salvar_veiculo(veiculo)
+
+# Troca o status do veículo mantendo os agregados em dia (quem chama deve estar dentro de exclusivo)
+def _mudar_status(veiculo, status):
+    if veiculo.status != status:
+        agregados.alterar_status(veiculo.status, status)
+        veiculo.status = status
+
+# Função para alterar o status de um veículo (por exemplo, manutenção)
+@repetir_apos_recarga
+def alterar_status_veiculo(veiculo, status):
+    with exclusivo(veiculo):
+        _mudar_status(veiculo, status)
+        salvar_veiculo(veiculo)
 # Função para buscar locações com base em filtros
-def buscar_locacoes(nome_cliente=None, cpf_cliente=None, placa_veiculo=None, tipo_veiculo=None, categoria_veiculo=None, data_inicio=None, data_fim=None):
-    locacoes_filtradas = historico.listar_historico()
-
-    if nome_cliente:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.cliente.nome.lower() == nome_cliente.lower()]
-    if cpf_cliente:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.cliente.cpf == cpf_cliente]
-    if placa_veiculo:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.veiculo.placa == placa_veiculo]
-    if tipo_veiculo:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.veiculo.tipo.lower() == tipo_veiculo.lower()]
-    if categoria_veiculo:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.veiculo.categoria.lower() == categoria_veiculo.lower()]
-    if data_inicio:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.data_retirada >= data_inicio]
-    if data_fim:
-        locacoes_filtradas = [l for l in locacoes_filtradas if l.data_devolucao_prevista <= data_fim]
-
-    if locacoes_filtradas:
-        df_locacoes_filtradas = pd.DataFrame([{
-            'Cliente': l.cliente.nome,
-            'Veículo': l.veiculo.modelo,
-            'Placa': l.veiculo.placa,
-            'Data Retirada': l.data_retirada,
-            'Data Devolução Prevista': l.data_devolucao_prevista,
-            'Data Devolução Real': l.data_devolucao_real,
-            'Distância (km)': l.distancia_km
-        } for l in locacoes_filtradas])
-        print("\nResultados da Busca de Locações:")
-        print(df_locacoes_filtradas.to_string(index=False))
-    else:
+@instrumentado
+def buscar_locacoes(nome_cliente=None, cpf_cliente=None, placa_veiculo=None, tipo_veiculo=None, categoria_veiculo=None, data_inicio=None, data_fim=None,
+                    ordenar_por=None, decrescente=False, inicio=0, limite=None, pausar=False):
+    registros = iterar_locacoes(nome_cliente, cpf_cliente, placa_veiculo, tipo_veiculo, categoria_veiculo,
+                                data_inicio, data_fim, ordenar_por=ordenar_por, decrescente=decrescente,
+                                inicio=inicio, limite=limite)
+    if not imprimir_paginas(registros, "\nResultados da Busca de Locações:", pausar=pausar):
         print("Nenhuma locação encontrada com os filtros fornecidos.")
 
 
+# Verifica se o veículo pode ser reservado no período [inicio, fim]
+def veiculo_disponivel(veiculo, inicio, fim):
+    if veiculo.status == 'em manutenção':
+        return False
+    # Numa retirada imediata o veículo também precisa estar no pátio (não pode estar com outro cliente)
+    if pd.Timestamp(inicio) <= pd.Timestamp.today() and veiculo.status != 'disponível':
+        return False
+    return historico.veiculo_livre(veiculo, inicio, fim)
+
+# Função para listar os veículos livres em um período, com filtros de tipo e categoria
+def veiculos_livres(inicio, fim, tipo=None, categoria=None):
+    tipo = tipo.lower() if tipo else None
+    categoria = categoria.lower() if categoria else None
+    return [v for v in repositorio.listar_veiculos()
+            if (tipo is None or v.tipo.lower() == tipo) and (categoria is None or v.categoria.lower() == categoria)
+            and veiculo_disponivel(v, inicio, fim)]
+
+# Verifica a disponibilidade e registra a locação em uma única operação atômica (dentro de exclusivo)
+@instrumentado
+def reservar_veiculo(locacao):
+    veiculo = locacao.veiculo
+    with exclusivo(veiculo):
+        if not veiculo_disponivel(veiculo, locacao.data_retirada, locacao.data_devolucao_prevista):
+            return False
+        # Reservas futuras não mudam o status; o veículo só fica alugado a partir da data de retirada
+        if pd.Timestamp(locacao.data_retirada) <= pd.Timestamp.today():
+            _mudar_status(veiculo, 'alugado')
+        historico.adicionar_locacao(locacao)
+        salvar_veiculo(veiculo)
+        salvar_locacao(locacao)
+        return True
+
+# Marca como alugados os veículos cujas reservas chegaram à data de retirada
+def iniciar_reservas_do_dia(hoje=None):
+    hoje = pd.Timestamp(hoje) if hoje is not None else pd.Timestamp.today()
+    iniciadas = 0
+    for locacao in historico.listar_abertas():
+        veiculo = locacao.veiculo
+        if veiculo.status != 'disponível' or pd.Timestamp(locacao.data_retirada) > hoje:
+            continue
+        # Confere de novo com os dados mais recentes: a reserva pode ter sido cancelada em outro processo
+        with exclusivo(veiculo):
+            if locacao._historico is not None and locacao.data_devolucao_real is None and veiculo.status == 'disponível':
+                _mudar_status(veiculo, 'alugado')
+                salvar_veiculo(veiculo)
+                iniciadas += 1
+    return iniciadas
+
 # Função para listar todos os veículos cadastrados
-def listar_veiculos():
-    df_veiculos = pd.DataFrame([vars(v) for v in veiculos])
+def listar_veiculos(ordenar_por=None, pausar=False):
     print("\nListagem de Veículos:")
-    print(df_veiculos.to_string(index=False))
+    imprimir_paginas(iterar_veiculos(ordenar_por=ordenar_por), pausar=pausar)
 
 # Função para alugar um veículo
-def alugar_veiculo(cliente, veiculo, data_retirada, data_devolucao_prevista, origem, destino, chave_api):
-    if veiculo.status == 'disponível':
+# A disponibilidade no período é conferida antes da consulta de distância (que pode demorar) e de novo,
+# de forma atômica, na reserva; assim dois balcões (threads ou processos) nunca reservam o mesmo veículo
+# em períodos que se cruzam.
+@repetir_apos_recarga
+@instrumentado
+def alugar_veiculo(cliente, veiculo, data_retirada, data_devolucao_prevista, origem, destino, chave_api,
+                   distancia_km=None, distancia_estimada=False):
+    if veiculo_disponivel(veiculo, data_retirada, data_devolucao_prevista):
         try:
-            distancia, _ = calcular_distancia_e_custo(origem, destino, chave_api, taxa_por_km=0.50)
+            # A distância já calculada (por exemplo, na importação em lote) dispensa a consulta
+            if distancia_km is not None:
+                distancia = distancia_km
+            else:
+                distancia, _ = calcular_distancia_e_custo(origem, destino, chave_api, taxa_por_km=0.50)
         except Exception as e:
-            print(f"Erro ao calcular a distância: {e}")
-            return None
-        
-        locacao = Locacao(cliente, veiculo, data_retirada, data_devolucao_prevista, distancia_km=distancia, taxa_por_km=0.50)
+            # Sem resposta da API, usa a estimativa local e marca a distância como estimada
+            try:
+                distancia, _ = estimar_distancia_e_custo(origem, destino, taxa_por_km=0.50)
+                distancia_estimada = True
+                print(f"API de distâncias indisponível ({e}); usando distância estimada.")
+            except ValueError:
+                print(f"Erro ao calcular a distância: {e}")
+                return None
         
-        # Atualiza o status do veículo antes de adicionar ao histórico e salvar os dados
-        veiculo.status = 'alugado'
+        locacao = Locacao(cliente, veiculo, data_retirada, data_devolucao_prevista, distancia_km=distancia, taxa_por_km=0.50,
+                          distancia_estimada=distancia_estimada)
         
-        # Adiciona a locação ao histórico e salva os dados
-        historico.adicionar_locacao(locacao)
-        salvar_dados()
-        
-        # Acumula pontos após a locação
-        locacao.acumular_pontos()
+        # Reserva o veículo, adiciona a locação ao histórico, acumula os pontos e registra as alterações,
+        # tudo a partir do estado mais recente do banco e gravado numa única unidade (tudo ou nada)
+        with exclusivo(veiculo, cliente), lote_de_alteracoes():
+            if not reservar_veiculo(locacao):
+                raise ValueError("Veículo não disponível")
+            pontos = locacao.acumular_pontos()
+            salvar_cliente(cliente)
+            agregados.registrar_pontos(data_retirada, pontos)
         
         # Exibe informações sobre a locação
         print(f"Locação realizada com sucesso!")
         print(f"Origem: {origem}")
         print(f"Destino: {destino}")
-        print(f"Distância: {distancia:.2f} km")
+        print(f"Distância: {distancia:.2f} km" + (" (estimada)" if distancia_estimada else ""))
         print(f"Multa, se houver atraso na entrega do veículo, com base na distância de {distancia:.2f} km e taxa de R$ 0,50 por km.")
         
         return locacao
@@ -222,11 +1627,32 @@ def alugar_veiculo(cliente, veiculo, data_retirada, data_devolucao_prevista, ori
         raise ValueError("Veículo não disponível")
 
 # Função para devolver um veículo
-def devolver_veiculo(locacao, data_devolucao_real):
-    locacao.data_devolucao_real = data_devolucao_real
-    locacao.veiculo.status = 'disponível'
-    multa = locacao.calcular_multa()
-    preco_base, total_a_pagar = locacao.calcular_preco_total(multa)
+@repetir_apos_recarga
+@instrumentado
+def devolver_veiculo(locacao, data_devolucao_real, pontos_usados=0):
+    with exclusivo(locacao.veiculo, locacao.cliente), lote_de_alteracoes():
+        # Dois balcões podem tentar devolver a mesma locação; só o primeiro conclui
+        if locacao.data_devolucao_real is not None:
+            raise ValueError("Locação já devolvida")
+        if locacao._historico is None:
+            raise ValueError("Locação cancelada")
+        if pd.Timestamp(data_devolucao_real) < pd.Timestamp(locacao.data_retirada):
+            raise ValueError("Data de devolução anterior à retirada")
+        historico.registrar_devolucao(locacao, data_devolucao_real)
+        # O veículo só volta ao pátio se nenhuma outra locação dele já tiver começado
+        hoje = pd.Timestamp.today()
+        if not any(pd.Timestamp(l.data_retirada) <= hoje for l in historico.abertas_do_veiculo(locacao.veiculo)):
+            _mudar_status(locacao.veiculo, 'disponível')
+        salvar_veiculo(locacao.veiculo)
+        salvar_locacao(locacao)
+        multa = locacao.calcular_multa()
+        preco_base, total_a_pagar = locacao.calcular_preco_total(multa)
+        agregados.registrar_receita(data_devolucao_real, total_a_pagar, multa)
+
+        # Aplica os pontos de fidelidade escolhidos pelo cliente
+        if pontos_usados:
+            desconto = locacao.cliente.usar_pontos(pontos_usados)
+            salvar_cliente(locacao.cliente)
     
     print(f"Veículo {locacao.veiculo.placa} devolvido com sucesso!")
     print(f"Preço base (sem multa): R${preco_base:.2f}")
@@ -234,87 +1660,1010 @@ def devolver_veiculo(locacao, data_devolucao_real):
     if multa > 0:
         print(f"Multa por atraso (baseada na distância de {locacao.distancia_km:.2f} km): R${multa:.2f}")
     
-    # Pergunta ao usuário se deseja usar os pontos de fidelidade
-    usar_pontos = input(f"Você deseja usar seus pontos de fidelidade para um desconto? (Você tem {locacao.cliente.pontos_fidelidade} pontos disponíveis) [s/n]: ").strip().lower()
-    
-    if usar_pontos == 's':
-        pontos_usados = int(input("Quantos pontos você deseja usar? "))
-        desconto = locacao.cliente.usar_pontos(pontos_usados)
+    if pontos_usados:
         total_a_pagar -= desconto
         print(f"Desconto aplicado: R${desconto:.2f}")
     else:
         print("Nenhum desconto aplicado.")
     
     print(f"Total a pagar após desconto: R${total_a_pagar:.2f}")
-    salvar_dados()
 
-# Função para carregar os dados de um arquivo Excel
-def carregar_dados():
-    global veiculos, clientes, historico
-    try:
-        # Verifica se o arquivo existe
-        if not os.path.exists('banco de dados.xlsx'):
-            # Se não existir, cria um novo arquivo Excel
-            workbook = Workbook()
-            workbook.save('banco de dados.xlsx')
-
-        # Carrega os dados dos veículos
-        df_veiculos = pd.read_excel('banco de dados.xlsx', sheet_name='Veiculos', engine='openpyxl')
-        veiculos = [Veiculo(row['modelo'], row['marca'], row['ano'], row['placa'], row['tipo'],
-                            row['categoria'], row.get('status', 'disponível')) for _, row in df_veiculos.iterrows()]
-
-        # Carrega os dados dos clientes
-        df_clientes = pd.read_excel('banco de dados.xlsx', sheet_name='Clientes', engine='openpyxl')
-        clientes = [Cliente(row['nome'], row['cpf'], row['telefone'], row['email'])
-                    for _, row in df_clientes.iterrows()]
-
-        # Carrega os dados das locações
-        df_locacoes = pd.read_excel('banco de dados.xlsx', sheet_name='Locacoes', engine='openpyxl')
-        for _, row in df_locacoes.iterrows():
-            cliente = next((c for c in clientes if c.cpf == row['cpf']), None)
-            veiculo = next((v for v in veiculos if v.placa == row['placa']), None)
+# Função para cancelar uma reserva que ainda não começou: a locação sai do histórico, os pontos
+# ganhos na reserva são estornados e, como não houve uso do veículo, nenhuma receita é registrada
+@repetir_apos_recarga
+@instrumentado
+def cancelar_reserva(locacao):
+    with exclusivo(locacao.veiculo, locacao.cliente), lote_de_alteracoes():
+        if locacao.data_devolucao_real is not None:
+            raise ValueError("Locação já devolvida")
+        if locacao._historico is None:
+            raise ValueError("Locação já cancelada")
+        if pd.Timestamp(locacao.data_retirada) <= pd.Timestamp.today():
+            raise ValueError("A locação já começou; registre a devolução")
+        historico.remover_locacao(locacao)
+        remover_locacao(locacao)
+        # Grava o veículo também, para que os outros processos percebam a mudança na agenda dele
+        salvar_veiculo(locacao.veiculo)
 
-            if cliente is None or veiculo is None:
-                continue
+        preco_base, _ = locacao.calcular_preco_total()
+        pontos = int(preco_base // 10)
+        # Os pontos da reserva podem já ter sido usados; o saldo não fica negativo
+        locacao.cliente.pontos_fidelidade -= min(pontos, locacao.cliente.pontos_fidelidade)
+        salvar_cliente(locacao.cliente)
+        agregados.registrar_pontos(locacao.data_retirada, -pontos)
+    print(f"Reserva do veículo {locacao.veiculo.placa} cancelada.")
 
-            data_retirada = pd.to_datetime(row['data_retirada'])
-            data_devolucao_prevista = pd.to_datetime(row['data_devolucao_prevista'])
-            distancia_km = row.get('distancia_km', 0)
-            locacao = Locacao(cliente, veiculo, data_retirada, data_devolucao_prevista, distancia_km=distancia_km)
-            locacao.data_devolucao_real = pd.to_datetime(row['data_devolucao_real']) if not pd.isna(row['data_devolucao_real']) else None
-            historico.adicionar_locacao(locacao)
-    except Exception as e:
-        print(f"Erro ao carregar dados: {e}")
+# Persistência---------------------------------------------------------------------------------------
+# Retorna uma coluna da planilha como lista, usando o valor padrão quando a coluna ou a célula estiver vazia
+def _coluna(df, nome, padrao):
+    if nome not in df.columns:
+        return [padrao] * len(df)
+    return df[nome].fillna(padrao).tolist()
 
-# Função para salvar os dados em um arquivo Excel
-def salvar_dados():
-    global veiculos, clientes, historico
-    try:
-        # Carrega o workbook existente
-        with pd.ExcelWriter('banco de dados.xlsx', engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+# Converte valores do numpy/pandas para tipos aceitos pelo JSON
+def _valor_json(valor):
+    if hasattr(valor, 'item'):
+        return valor.item()
+    return str(valor)
+
+# Converte valores do numpy para tipos aceitos pelo SQLite
+def _valor_sql(valor):
+    return valor.item() if hasattr(valor, 'item') else valor
+
+# Converte uma data para texto ISO (ou None quando não houver data)
+def _data_iso(data):
+    if data is None or pd.isna(data):
+        return None
+    return pd.Timestamp(data).isoformat()
+
+# Campos persistidos de uma locação (datas em texto ISO)
+def _registro_locacao(locacao):
+    return {
+        'cpf': locacao.cliente.cpf,
+        'placa': locacao.veiculo.placa,
+        'data_retirada': _data_iso(locacao.data_retirada),
+        'data_devolucao_prevista': _data_iso(locacao.data_devolucao_prevista),
+        'data_devolucao_real': _data_iso(locacao.data_devolucao_real),
+        'distancia_km': locacao.distancia_km,
+        'taxa_por_km': locacao.taxa_por_km,
+        'distancia_estimada': locacao.distancia_estimada
+    }
+
+# Monta os objetos a partir das tabelas de veículos, clientes e locações (de qualquer armazenamento)
+def _montar_dados(df_veiculos, df_clientes, df_locacoes):
+    # Carrega os dados dos veículos
+    for modelo, marca, ano, placa, tipo, categoria, status in zip(
+            *(df_veiculos[c].tolist() for c in ('modelo', 'marca', 'ano', 'placa', 'tipo', 'categoria')),
+            _coluna(df_veiculos, 'status', 'disponível')):
+        repositorio.adicionar_veiculo(Veiculo(modelo, marca, ano, placa, tipo, categoria, status))
+
+    # Carrega os dados dos clientes
+    for nome, cpf, telefone, email, pontos in zip(
+            *(df_clientes[c].tolist() for c in ('nome', 'cpf', 'telefone', 'email')),
+            _coluna(df_clientes, 'pontos_fidelidade', 0)):
+        cliente = Cliente(nome, cpf, telefone, email)
+        cliente.pontos_fidelidade = int(pontos)
+        repositorio.adicionar_cliente(cliente)
+
+    # Carrega os dados das locações: as chaves estrangeiras (cpf/placa) são resolvidas de uma vez contra
+    # os índices do repositório e as datas e distâncias vão como arrays direto para as colunas do histórico
+    clientes_locacao = df_locacoes['cpf'].map(repositorio.clientes_por_cpf)
+    veiculos_locacao = df_locacoes['placa'].map(repositorio.veiculos_por_placa)
+    validas = (clientes_locacao.notna() & veiculos_locacao.notna()).to_numpy()
+    df_locacoes = df_locacoes[validas]
+
+    datas = [pd.to_datetime(df_locacoes[c]).to_numpy(dtype='datetime64[ns]')
+             for c in ('data_retirada', 'data_devolucao_prevista', 'data_devolucao_real')]
+    historico.adicionar_colunas(clientes_locacao[validas].tolist(), veiculos_locacao[validas].tolist(), *datas,
+                                np.asarray(_coluna(df_locacoes, 'distancia_km', 0), dtype=np.float64),
+                                _coluna(df_locacoes, 'taxa_por_km', 0.50),
+                                _coluna(df_locacoes, 'distancia_estimada', False))
+
+# Erro de concorrência entre processos: outro processo alterou o banco de um jeito que os dados
+# em memória não acompanham (por exemplo, compactou o snapshot). É preciso recarregar os dados.
+class ErroConcorrencia(RuntimeError):
+    pass
+
+# Abre e trava, exclusivamente entre processos, o arquivo de trava (espera enquanto outro processo o tiver)
+def _travar_arquivo(caminho):
+    arquivo = open(caminho, 'a+b')
+    if fcntl is not None:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+    else:
+        arquivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                pass  # LK_LOCK desiste depois de 10 tentativas; continua esperando
+    return arquivo
+
+def _destravar_arquivo(arquivo):
+    if fcntl is not None:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+    else:
+        arquivo.seek(0)
+        msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+    arquivo.close()
+
+# Definição da classe armazenamento em Excel
+# O estado completo fica em um snapshot (o workbook) e cada alteração é acrescentada a um journal
+# append-only; o carregamento reaplica o journal sobre o snapshot.
+# Vários processos podem usar o mesmo banco: as escritas acontecem em seções exclusivas, sob uma
+# trava de arquivo, e cada seção começa aplicando o que os outros processos acrescentaram ao journal.
+# Se outro processo compactou o snapshot, a seção é recusada com ErroConcorrencia antes de qualquer
+# alteração; as operações de balcão então recarregam os dados e se repetem (repetir_apos_recarga).
+class ArmazenamentoExcel:
+    # Planilhas do snapshot e as colunas de cada uma (uma planilha ausente é lida como vazia)
+    PLANILHAS = {
+        'Veiculos': Veiculo.CAMPOS,
+        'Clientes': Cliente.CAMPOS,
+        'Locacoes': ('nome', 'cpf', 'placa', 'data_retirada', 'data_devolucao_prevista', 'data_devolucao_real',
+                     'distancia_km', 'taxa_por_km', 'distancia_estimada')
+    }
+
+    def __init__(self, arquivo=ARQUIVO_DADOS, journal=ARQUIVO_JOURNAL, limite_journal=LIMITE_JOURNAL):
+        self.arquivo = arquivo
+        self.journal = journal
+        self.limite_journal = limite_journal
+        self.entradas_journal = 0  # Alterações gravadas no journal desde o último snapshot
+        # Quando o snapshot não pôde ser lido, os dados em memória estão incompletos e não podem substituí-lo
+        self.falha_carregamento = False
+        self._local = threading.local()  # Lote e seções exclusivas aninhadas em andamento em cada thread
+        self._trava = threading.RLock()  # Serializa as escritas no journal e a compactação
+        self._arquivo_trava = None
+        self._posicao_journal = 0  # Bytes do journal já aplicados à memória
+        self._assinatura_snapshot = None  # Snapshot lido: (inode, modificação, tamanho)
+
+    def _assinatura(self):
+        try:
+            estado = os.stat(self.arquivo)
+        except FileNotFoundError:
+            return None
+        return estado.st_ino, estado.st_mtime_ns, estado.st_size
+
+    # Trava entre threads e processos (reentrante); informa se esta é a entrada mais externa
+    @contextmanager
+    def _trava_processos(self):
+        with self._trava:
+            externa = getattr(self._local, 'profundidade', 0) == 0
+            if externa:
+                self._arquivo_trava = _travar_arquivo((self.journal or self.arquivo) + '.trava')
+            self._local.profundidade = getattr(self._local, 'profundidade', 0) + 1
+            try:
+                yield externa
+            finally:
+                self._local.profundidade -= 1
+                if externa:
+                    _destravar_arquivo(self._arquivo_trava)
+                    self._arquivo_trava = None
+
+    # Seção exclusiva: na entrada mais externa, traz para a memória as alterações dos outros processos
+    @contextmanager
+    def exclusivo(self, *objetos):
+        with self._trava_processos() as externa:
+            if externa:
+                self._sincronizar()
+            yield
+
+    # Informa se a thread atual está dentro de uma seção exclusiva
+    def em_secao(self):
+        return getattr(self._local, 'profundidade', 0) > 0
+
+    def _sincronizar(self):
+        if self._assinatura() != self._assinatura_snapshot:
+            raise ErroConcorrencia("O banco foi compactado por outro processo; recarregue os dados")
+        tamanho = os.path.getsize(self.journal) if self.journal and os.path.exists(self.journal) else 0
+        if tamanho < self._posicao_journal:
+            raise ErroConcorrencia("O journal foi reescrito por outro processo; recarregue os dados")
+        if tamanho > self._posicao_journal:
+            self._aplicar_journal(self._posicao_journal)
+
+    def carregar(self):
+        with self._trava_processos():
+            self._carregar()
+            self._assinatura_snapshot = self._assinatura()
+
+    def _carregar(self):
+        self.falha_carregamento = False
+        try:
+            # Verifica se o arquivo existe
+            if not os.path.exists(self.arquivo):
+                # Se não existir, cria um novo arquivo Excel
+                workbook = Workbook()
+                workbook.save(self.arquivo)
+
+            # Lê as planilhas de uma só vez (o arquivo é descompactado uma única vez); as que faltarem
+            # ficam vazias. CPF e placa são chaves: lidos como texto para não perder zeros à esquerda.
+            with pd.ExcelFile(self.arquivo, engine='openpyxl') as livro:
+                existentes = [nome for nome in self.PLANILHAS if nome in livro.sheet_names]
+                planilhas = pd.read_excel(livro, sheet_name=existentes, dtype={'cpf': str, 'placa': str}) if existentes else {}
+            for nome, colunas in self.PLANILHAS.items():
+                if nome not in planilhas:
+                    planilhas[nome] = pd.DataFrame(columns=colunas)
+            _montar_dados(planilhas['Veiculos'], planilhas['Clientes'], planilhas['Locacoes'])
+        except Exception as e:
+            self.falha_carregamento = True
+            print(f"Erro ao carregar dados: {e}")
+
+        # Reaplica as alterações registradas no journal depois do último snapshot
+        self._aplicar_journal()
+
+    # Grava o snapshot completo
+    def gravar_completo(self):
+        # Grava um workbook novo em um arquivo temporário e só então substitui o snapshot anterior,
+        # assim uma queda durante a gravação não corrompe o banco (e não sobram formatos de células antigas)
+        nome_base, extensao = os.path.splitext(self.arquivo)
+        arquivo_temporario = nome_base + '.tmp' + extensao
+        with pd.ExcelWriter(arquivo_temporario, engine='openpyxl') as writer:
             # Salva os dados dos veículos
-            df_veiculos = pd.DataFrame([vars(v) for v in veiculos])
+            df_veiculos = pd.DataFrame([v.para_dict() for v in repositorio.listar_veiculos()],
+                                       columns=self.PLANILHAS['Veiculos'])
             df_veiculos.to_excel(writer, sheet_name='Veiculos', index=False)
 
             # Salva os dados dos clientes
-            df_clientes = pd.DataFrame([vars(c) for c in clientes])
+            df_clientes = pd.DataFrame([c.para_dict() for c in repositorio.listar_clientes()],
+                                       columns=self.PLANILHAS['Clientes'])
             df_clientes.to_excel(writer, sheet_name='Clientes', index=False)
 
             # Salva os dados das locações
-            locacoes_data = [{
-                'nome': l.cliente.nome,
-                'cpf': l.cliente.cpf,
-                'placa': l.veiculo.placa,
-                'data_retirada': l.data_retirada,
-                'data_devolucao_prevista': l.data_devolucao_prevista,
-                'data_devolucao_real': l.data_devolucao_real,
-                'distancia_km': l.distancia_km
-            } for l in historico.listar_historico()]
-            df_locacoes = pd.DataFrame(locacoes_data)
+            df_locacoes = pd.DataFrame([{'nome': l.cliente.nome, **_registro_locacao(l)}
+                                        for l in historico.listar_historico()], columns=self.PLANILHAS['Locacoes'])
+            for coluna in ('data_retirada', 'data_devolucao_prevista', 'data_devolucao_real'):
+                if coluna in df_locacoes:
+                    df_locacoes[coluna] = pd.to_datetime(df_locacoes[coluna])
             df_locacoes.to_excel(writer, sheet_name='Locacoes', index=False)
 
-    except Exception as e:
-        print(f"Erro ao salvar dados: {e}")
+        os.replace(arquivo_temporario, self.arquivo)
+        instrumentacao.contar('persistencia.bytes', os.path.getsize(self.arquivo))
+
+    # Compacta o journal no snapshot
+    def compactar(self):
+        try:
+            with self.exclusivo():
+                if self.falha_carregamento and os.path.exists(self.arquivo):
+                    print(f"O snapshot {self.arquivo} não foi carregado corretamente e não será sobrescrito; "
+                          f"as alterações continuam no journal.")
+                    return
+                try:
+                    self.gravar_completo()
+                except Exception as e:
+                    print(f"Erro ao salvar dados: {e}")
+                    return
+
+                # O snapshot já contém todas as alterações, então o journal pode ser descartado
+                if self.journal:
+                    open(self.journal, 'w', encoding='utf-8').close()
+                self.entradas_journal = 0
+                self._posicao_journal = 0
+                self._assinatura_snapshot = self._assinatura()
+        except ErroConcorrencia as e:
+            # As alterações deste processo já estão no journal; só o snapshot deixa de ser gravado
+            print(f"Snapshot não gravado: {e}")
+
+    # Grava um registro (uma linha) no journal
+    def _gravar_journal(self, registro, quantidade):
+        linha = json.dumps(registro, ensure_ascii=False, default=_valor_json) + '\n'
+        with self.exclusivo():
+            try:
+                with open(self.journal, 'ab') as journal:
+                    journal.write(linha.encode('utf-8'))
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    self._posicao_journal = journal.tell()
+            except Exception as e:
+                print(f"Erro ao salvar dados: {e}")
+                return
+
+            instrumentacao.contar('persistencia.bytes', len(linha.encode('utf-8')))
+            instrumentacao.contar('persistencia.gravacoes')
+            self.entradas_journal += quantidade
+            # Compacta o journal no snapshot quando ele fica grande demais. Um lote do tamanho do limite
+            # ou maior (uma importação) não dispara a compactação, que custa proporcional ao banco inteiro;
+            # a próxima operação de balcão o fará.
+            if quantidade < self.limite_journal and self.entradas_journal >= self.limite_journal:
+                self.compactar()
+
+    # Registra a alteração de uma entidade no journal (append-only)
+    def registrar_alteracao(self, entidade, dados):
+        alteracao = {'entidade': entidade, 'dados': dados}
+        lote = getattr(self._local, 'lote', None)
+        if lote is not None:
+            lote.append(alteracao)
+        else:
+            self._gravar_journal(alteracao, 1)
+
+    # Agrupa as alterações feitas dentro do bloco em um único registro do journal.
+    # Como o lote inteiro ocupa uma só linha, ou ele é reaplicado por completo ou não é reaplicado.
+    # O lote inteiro é uma seção exclusiva, para que nenhum outro processo grave no meio dele.
+    # Um lote aberto dentro de outro (uma operação de balcão numa importação) faz parte do externo.
+    @contextmanager
+    def lote(self):
+        if getattr(self._local, 'lote', None) is not None:
+            yield
+            return
+        with self.exclusivo():
+            self._local.lote = []
+            try:
+                yield
+                alteracoes = self._local.lote
+            finally:
+                self._local.lote = None
+            if alteracoes:
+                self._gravar_journal({'lote': alteracoes}, len(alteracoes))
+
+    def salvar_veiculo(self, veiculo):
+        self.registrar_alteracao('veiculo', veiculo.para_dict())
+
+    def salvar_cliente(self, cliente):
+        self.registrar_alteracao('cliente', cliente.para_dict())
+
+    def salvar_locacao(self, locacao):
+        self.registrar_alteracao('locacao', _registro_locacao(locacao))
+
+    def remover_locacao(self, locacao):
+        registro = _registro_locacao(locacao)
+        self.registrar_alteracao('locacao_removida', {c: registro[c] for c in ('cpf', 'placa', 'data_retirada')})
+
+    # Reaplica o journal sobre os dados carregados do snapshot (ou, a partir de `inicio`, só o que
+    # outros processos acrescentaram); cada alteração custa o mesmo que a original, não o banco inteiro
+    def _aplicar_journal(self, inicio=0):
+        if inicio == 0:
+            self.entradas_journal = 0
+        self._posicao_journal = inicio
+        if not self.journal or not os.path.exists(self.journal):
+            return
+
+        with open(self.journal, 'rb') as journal:
+            journal.seek(inicio)
+            for linha in journal:
+                try:
+                    alteracao = json.loads(linha)
+                except ValueError:
+                    # Linha incompleta (queda durante a escrita): ignora
+                    continue
+                alteracoes = alteracao['lote'] if 'lote' in alteracao else [alteracao]
+                for alteracao in alteracoes:
+                    self.entradas_journal += 1
+                    _aplicar_alteracao(alteracao['entidade'], alteracao['dados'])
+            self._posicao_journal = journal.tell()
+
+# Reaplica uma única alteração (do journal ou lida do banco), mantendo os agregados em dia
+def _aplicar_alteracao(entidade, dados):
+    if entidade == 'veiculo':
+        veiculo = repositorio.buscar_veiculo(dados['placa'])
+        if veiculo is None:
+            veiculo = Veiculo(dados['modelo'], dados['marca'], dados['ano'], dados['placa'],
+                              dados['tipo'], dados['categoria'])
+            repositorio.adicionar_veiculo(veiculo)
+        else:
+            agregados.retirar_veiculo(veiculo)
+        for campo, valor in dados.items():
+            setattr(veiculo, campo, valor)
+        agregados.registrar_veiculo(veiculo)
+    elif entidade == 'cliente':
+        cliente = repositorio.buscar_cliente(dados['cpf'])
+        if cliente is None:
+            cliente = Cliente(dados['nome'], dados['cpf'], dados['telefone'], dados['email'])
+            repositorio.adicionar_cliente(cliente)
+        for campo, valor in dados.items():
+            setattr(cliente, campo, valor)
+    elif entidade == 'locacao':
+        locacao = historico.buscar_locacao(dados['cpf'], dados['placa'], dados['data_retirada'])
+        real = pd.Timestamp(dados['data_devolucao_real']) if dados['data_devolucao_real'] else None
+        if locacao is None:
+            cliente = repositorio.buscar_cliente(dados['cpf'])
+            veiculo = repositorio.buscar_veiculo(dados['placa'])
+            if cliente is None or veiculo is None:
+                return
+            locacao = Locacao(cliente, veiculo, pd.Timestamp(dados['data_retirada']),
+                              pd.Timestamp(dados['data_devolucao_prevista']),
+                              distancia_km=dados['distancia_km'], taxa_por_km=dados['taxa_por_km'],
+                              distancia_estimada=dados.get('distancia_estimada', False))
+            historico.adicionar_locacao(locacao)
+        elif locacao.data_devolucao_real == real:
+            return
+        else:
+            agregados.registrar_locacao(locacao, -1)
+        historico.registrar_devolucao(locacao, real)
+        agregados.registrar_locacao(locacao)
+    elif entidade == 'locacao_removida':
+        locacao = historico.buscar_locacao(dados['cpf'], dados['placa'], dados['data_retirada'])
+        if locacao is not None:
+            agregados.registrar_locacao(locacao, -1)
+            historico.remover_locacao(locacao)
+
+# Definição da classe armazenamento em SQLite
+# Cada alteração é um upsert de uma única linha dentro de uma transação, então o custo de gravar
+# depende só do que mudou. O banco usa WAL e tem índices em cpf, placa e datas das locações.
+# Cada thread usa a sua própria conexão (e portanto a sua própria transação); o SQLite
+# serializa as escritas e o WAL deixa as leituras correrem em paralelo.
+# Veículos e clientes têm uma coluna de versão: cada gravação só acontece se a linha ainda estiver na
+# versão lida (UPDATE ... WHERE versao = ?), senão levanta ErroConcorrencia. As operações de balcão
+# rodam em seções exclusivas (BEGIN IMMEDIATE) que antes atualizam da base os objetos envolvidos,
+# de modo que dois processos nunca decidem a partir de dados velhos.
+class ArmazenamentoSQLite:
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS veiculos (
+            id INTEGER PRIMARY KEY, modelo TEXT, marca TEXT, ano, placa TEXT,
+            tipo TEXT, categoria TEXT, status TEXT, versao INTEGER NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS idx_veiculos_placa ON veiculos (placa);
+        CREATE TABLE IF NOT EXISTS clientes (
+            cpf TEXT PRIMARY KEY, nome TEXT, telefone TEXT, email TEXT, pontos_fidelidade INTEGER,
+            versao INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS locacoes (
+            id INTEGER PRIMARY KEY, cpf TEXT, placa TEXT, data_retirada TEXT,
+            data_devolucao_prevista TEXT, data_devolucao_real TEXT, distancia_km REAL,
+            taxa_por_km REAL, distancia_estimada INTEGER, UNIQUE (cpf, placa, data_retirada));
+        CREATE INDEX IF NOT EXISTS idx_locacoes_cpf ON locacoes (cpf);
+        CREATE INDEX IF NOT EXISTS idx_locacoes_placa ON locacoes (placa);
+        CREATE INDEX IF NOT EXISTS idx_locacoes_retirada ON locacoes (data_retirada);
+        CREATE INDEX IF NOT EXISTS idx_locacoes_prevista ON locacoes (data_devolucao_prevista);
+    """
+    CAMPOS_VEICULO = ('modelo', 'marca', 'ano', 'placa', 'tipo', 'categoria', 'status')
+    CAMPOS_CLIENTE = ('cpf', 'nome', 'telefone', 'email', 'pontos_fidelidade')
+    CAMPOS_LOCACAO = ('cpf', 'placa', 'data_retirada', 'data_devolucao_prevista', 'data_devolucao_real',
+                      'distancia_km', 'taxa_por_km', 'distancia_estimada')
+
+    def __init__(self, arquivo=ARQUIVO_SQLITE, espera=30):
+        self.arquivo = arquivo
+        self.espera = espera  # Segundos que uma escrita aguarda a trava do banco antes de falhar
+        self._local = threading.local()  # Conexão e seção exclusiva em andamento de cada thread
+        # Placas podem se repetir nos dados antigos, então cada veículo é ligado ao id da sua linha
+        self._ids_veiculos = {}
+        self._versoes = {}  # Versão lida/gravada de cada veículo e cliente (id do objeto -> versão)
+        self._trava = threading.RLock()  # Serializa as seções exclusivas das threads deste processo
+
+    def conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = self._local.conexao = sqlite3.connect(self.arquivo, timeout=self.espera)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.executescript(self.ESQUEMA)
+            # Bancos criados antes da coluna de versão
+            for tabela in ('veiculos', 'clientes'):
+                if 'versao' not in [coluna[1] for coluna in conexao.execute(f"PRAGMA table_info({tabela})")]:
+                    conexao.execute(f"ALTER TABLE {tabela} ADD COLUMN versao INTEGER NOT NULL DEFAULT 0")
+        return conexao
+
+    def carregar(self):
+        try:
+            # As três tabelas são lidas na mesma transação, sem gravações de outros processos no meio
+            with self.exclusivo():
+                conexao = self.conexao()
+                df_veiculos = pd.read_sql_query("SELECT * FROM veiculos ORDER BY id", conexao)
+                df_clientes = pd.read_sql_query("SELECT * FROM clientes ORDER BY rowid", conexao)
+                df_locacoes = pd.read_sql_query("SELECT * FROM locacoes ORDER BY id", conexao)
+            _montar_dados(df_veiculos, df_clientes, df_locacoes)
+            veiculos, clientes = repositorio.listar_veiculos(), repositorio.listar_clientes()
+            self._ids_veiculos = {id(v): linha for v, linha in zip(veiculos, df_veiculos['id'].tolist())}
+            self._versoes = dict(zip(map(id, veiculos), df_veiculos['versao'].tolist()))
+            self._versoes.update(zip(map(id, clientes), df_clientes['versao'].tolist()))
+        except Exception as e:
+            print(f"Erro ao carregar dados: {e}")
+
+    # Seção exclusiva entre threads e processos: uma transação BEGIN IMMEDIATE (que reserva a escrita
+    # no banco) em que os objetos informados são antes atualizados com o que outros processos gravaram.
+    # As seções aninhadas fazem parte da mais externa, que confirma ou desfaz tudo no final.
+    @contextmanager
+    def exclusivo(self, *objetos):
+        with self._trava:
+            conexao = self.conexao()
+            externa = getattr(self._local, 'profundidade', 0) == 0
+            if externa:
+                if conexao.in_transaction:
+                    conexao.commit()
+                conexao.execute("BEGIN IMMEDIATE")
+                self._local.desfazer = []
+            self._local.profundidade = getattr(self._local, 'profundidade', 0) + 1
+            try:
+                if externa:
+                    self._sincronizar(conexao, objetos)
+                yield
+                if externa:
+                    conexao.commit()
+                    instrumentacao.contar('persistencia.gravacoes')
+            except BaseException:
+                if externa:
+                    conexao.rollback()
+                    # As versões gravadas na transação desfeita voltam a ser as anteriores
+                    for chave, versao in reversed(self._local.desfazer):
+                        self._versoes[chave] = versao
+                raise
+            finally:
+                self._local.profundidade -= 1
+
+    # Informa se a thread atual está dentro de uma seção exclusiva
+    def em_secao(self):
+        return getattr(self._local, 'profundidade', 0) > 0
+
+    def _nova_versao(self, objeto, versao):
+        self._local.desfazer.append((id(objeto), self._versoes.get(id(objeto))))
+        self._versoes[id(objeto)] = versao
+
+    # Atualiza os veículos e clientes informados (e as locações desses veículos) a partir do banco;
+    # os agregados recebem só a diferença de cada linha alterada
+    def _sincronizar(self, conexao, objetos):
+        for objeto in objetos:
+            if isinstance(objeto, Veiculo):
+                self._atualizar_veiculo(conexao, objeto)
+            else:
+                self._atualizar_cliente(conexao, objeto)
+
+    def _atualizar_veiculo(self, conexao, veiculo):
+        linha = self._ids_veiculos.get(id(veiculo))
+        registro = None if linha is None else conexao.execute(
+            f"SELECT {', '.join(self.CAMPOS_VEICULO)}, versao FROM veiculos WHERE id = ?", [linha]).fetchone()
+        if registro is None or registro[-1] == self._versoes.get(id(veiculo)):
+            return
+        agregados.retirar_veiculo(veiculo)
+        for campo, valor in zip(self.CAMPOS_VEICULO, registro):
+            setattr(veiculo, campo, valor)
+        agregados.registrar_veiculo(veiculo)
+        self._versoes[id(veiculo)] = registro[-1]
+
+        # Toda mudança nas locações de um veículo também grava o veículo, então a versão dele
+        # indica quando é preciso reler as locações (só o primeiro veículo da placa tem locações)
+        if repositorio.buscar_veiculo(veiculo.placa) is veiculo:
+            existentes = {(l.cliente.cpf, l.veiculo.placa, _data_iso(l.data_retirada))
+                          for l in historico.locacoes_do_veiculo(veiculo)}
+            no_banco = set()
+            for registro in conexao.execute(
+                    f"SELECT {', '.join(self.CAMPOS_LOCACAO)} FROM locacoes WHERE placa = ?", [veiculo.placa]):
+                dados = dict(zip(self.CAMPOS_LOCACAO, registro))
+                dados['distancia_estimada'] = bool(dados['distancia_estimada'])
+                if repositorio.buscar_cliente(dados['cpf']) is None:
+                    self._carregar_cliente(conexao, dados['cpf'])
+                no_banco.add((dados['cpf'], dados['placa'], dados['data_retirada']))
+                _aplicar_alteracao('locacao', dados)
+            for chave in existentes - no_banco:
+                _aplicar_alteracao('locacao_removida', dict(zip(('cpf', 'placa', 'data_retirada'), chave)))
+
+    def _atualizar_cliente(self, conexao, cliente):
+        registro = conexao.execute(
+            f"SELECT {', '.join(self.CAMPOS_CLIENTE)}, versao FROM clientes WHERE cpf = ?", [cliente.cpf]).fetchone()
+        if registro is None or id(cliente) not in self._versoes or registro[-1] == self._versoes[id(cliente)]:
+            return
+        for campo, valor in zip(self.CAMPOS_CLIENTE, registro):
+            setattr(cliente, campo, valor)
+        self._versoes[id(cliente)] = registro[-1]
+
+    # Cliente cadastrado por outro processo que aparece numa locação
+    def _carregar_cliente(self, conexao, cpf):
+        registro = conexao.execute(
+            f"SELECT {', '.join(self.CAMPOS_CLIENTE)}, versao FROM clientes WHERE cpf = ?", [cpf]).fetchone()
+        if registro is not None:
+            dados = dict(zip(self.CAMPOS_CLIENTE, registro))
+            cliente = Cliente(dados['nome'], cpf, dados['telefone'], dados['email'])
+            cliente.pontos_fidelidade = int(dados['pontos_fidelidade'])
+            repositorio.adicionar_cliente(cliente)
+            self._versoes[id(cliente)] = registro[-1]
+
+    # No SQLite os bytes contados são os dos valores enviados ao banco (sem índices nem páginas do WAL)
+    @staticmethod
+    def _contar_bytes(valores):
+        if instrumentacao.ativa:
+            instrumentacao.contar('persistencia.bytes', sum(len(str(v).encode('utf-8')) for v in valores if v is not None))
+
+    def salvar_veiculo(self, veiculo):
+        valores = [_valor_sql(getattr(veiculo, c)) for c in self.CAMPOS_VEICULO]
+        with self.exclusivo():
+            conexao = self.conexao()
+            linha = self._ids_veiculos.get(id(veiculo))
+            if linha is None:
+                cursor = conexao.execute(f"INSERT INTO veiculos ({', '.join(self.CAMPOS_VEICULO)}) VALUES (?, ?, ?, ?, ?, ?, ?)", valores)
+                self._ids_veiculos[id(veiculo)] = cursor.lastrowid
+                self._nova_versao(veiculo, 0)
+            else:
+                versao = self._versoes.get(id(veiculo), 0)
+                cursor = conexao.execute(
+                    f"UPDATE veiculos SET {', '.join(c + ' = ?' for c in self.CAMPOS_VEICULO)}, versao = versao + 1 "
+                    f"WHERE id = ? AND versao = ?", valores + [linha, versao])
+                if cursor.rowcount == 0:
+                    raise ErroConcorrencia(f"O veículo {veiculo.placa} foi alterado por outro processo; recarregue os dados")
+                self._nova_versao(veiculo, versao + 1)
+            self._contar_bytes(valores)
+
+    def salvar_cliente(self, cliente):
+        valores = [_valor_sql(getattr(cliente, c)) for c in self.CAMPOS_CLIENTE]
+        with self.exclusivo():
+            conexao = self.conexao()
+            versao = self._versoes.get(id(cliente))
+            if versao is None:
+                try:
+                    conexao.execute(f"INSERT INTO clientes ({', '.join(self.CAMPOS_CLIENTE)}) VALUES (?, ?, ?, ?, ?)", valores)
+                except sqlite3.IntegrityError:
+                    raise ErroConcorrencia(f"O CPF {cliente.cpf} foi cadastrado por outro processo; recarregue os dados")
+                self._nova_versao(cliente, 0)
+            else:
+                cursor = conexao.execute(
+                    f"UPDATE clientes SET {', '.join(c + ' = ?' for c in self.CAMPOS_CLIENTE[1:])}, versao = versao + 1 "
+                    f"WHERE cpf = ? AND versao = ?", valores[1:] + [valores[0], versao])
+                if cursor.rowcount == 0:
+                    raise ErroConcorrencia(f"O cliente {cliente.cpf} foi alterado por outro processo; recarregue os dados")
+                self._nova_versao(cliente, versao + 1)
+            self._contar_bytes(valores)
+
+    # As locações são protegidas pela versão do veículo, que é gravado junto em toda mudança de locação
+    def salvar_locacao(self, locacao):
+        registro = _registro_locacao(locacao)
+        valores = [_valor_sql(registro[c]) for c in self.CAMPOS_LOCACAO]
+        with self.exclusivo():
+            self.conexao().execute(
+                f"INSERT INTO locacoes ({', '.join(self.CAMPOS_LOCACAO)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (cpf, placa, data_retirada) DO UPDATE SET "
+                f"{', '.join(f'{c} = excluded.{c}' for c in self.CAMPOS_LOCACAO[3:])}",
+                valores)
+            self._contar_bytes(valores)
+
+    def remover_locacao(self, locacao):
+        registro = _registro_locacao(locacao)
+        with self.exclusivo():
+            self.conexao().execute("DELETE FROM locacoes WHERE cpf = ? AND placa = ? AND data_retirada = ?",
+                                   [_valor_sql(registro[c]) for c in ('cpf', 'placa', 'data_retirada')])
+
+    # Todas as alterações do bloco entram em uma única transação
+    def lote(self):
+        return self.exclusivo()
+
+    # Regrava todas as tabelas a partir dos dados em memória (usado na migração)
+    def gravar_completo(self):
+        with self.exclusivo():
+            conexao = self.conexao()
+            conexao.execute("DELETE FROM locacoes")
+            conexao.execute("DELETE FROM clientes")
+            conexao.execute("DELETE FROM veiculos")
+            self._ids_veiculos = {}
+            self._versoes = {id(c): 0 for c in repositorio.listar_clientes()}
+            for veiculo in repositorio.listar_veiculos():
+                cursor = conexao.execute(f"INSERT INTO veiculos ({', '.join(self.CAMPOS_VEICULO)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         [_valor_sql(getattr(veiculo, c)) for c in self.CAMPOS_VEICULO])
+                self._ids_veiculos[id(veiculo)] = cursor.lastrowid
+                self._versoes[id(veiculo)] = 0
+            conexao.executemany(
+                f"INSERT OR REPLACE INTO clientes ({', '.join(self.CAMPOS_CLIENTE)}) VALUES (?, ?, ?, ?, ?)",
+                ([_valor_sql(getattr(c, campo)) for campo in self.CAMPOS_CLIENTE] for c in repositorio.listar_clientes()))
+            conexao.executemany(
+                f"INSERT OR REPLACE INTO locacoes ({', '.join(self.CAMPOS_LOCACAO)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ([_valor_sql(r[c]) for c in self.CAMPOS_LOCACAO]
+                 for r in map(_registro_locacao, historico.listar_historico())))
+
+    # Com SQLite tudo já está gravado; só transfere o WAL para o arquivo principal
+    def compactar(self):
+        try:
+            conexao = self.conexao()
+            conexao.commit()
+            conexao.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            print(f"Erro ao salvar dados: {e}")
+
+# Cria o armazenamento configurado ('excel' ou 'sqlite')
+def criar_armazenamento(tipo=ARMAZENAMENTO):
+    if tipo == 'sqlite':
+        return ArmazenamentoSQLite()
+    if tipo == 'excel':
+        return ArmazenamentoExcel()
+    raise ValueError(f"Armazenamento desconhecido: {tipo}")
+
+# Inicializa o armazenamento
+armazenamento = criar_armazenamento()
+
+# Descarta os dados em memória
+def _reiniciar_memoria():
+    global repositorio, historico, agregados
+    repositorio = Repositorio()
+    historico = HistoricoLocacao()
+    agregados = AgregadosFrota()
+
+# Função para reprecificar todo o histórico (por exemplo, com uma nova tabela de preços ou taxa por km)
+def reprecificar_historico(tabela_precos=None, taxa_por_km=None):
+    precos = historico.reprecificar(tabela_precos, taxa_por_km)
+    locacoes = historico.listar_historico()
+    precos.insert(0, 'cpf', [l.cliente.cpf for l in locacoes])
+    precos.insert(1, 'placa', [l.veiculo.placa for l in locacoes])
+    precos.insert(2, 'data_retirada', historico.retirada[:historico.tamanho])
+    return precos
+
+# Reconstrói os agregados a partir dos dados em memória
+def reconstruir_agregados():
+    global agregados
+    agregados = AgregadosFrota.construir(repositorio, historico)
+    return agregados
+
+# Função para carregar os dados do armazenamento configurado
+@instrumentado
+def carregar_dados():
+    _reiniciar_memoria()
+    with instrumentacao.medir('carregar_dados.armazenamento'):
+        armazenamento.carregar()
+    with instrumentacao.medir('carregar_dados.agregados'):
+        reconstruir_agregados()
+    iniciar_reservas_do_dia()
+
+# Função para salvar os dados (snapshot completo no Excel)
+@instrumentado
+def salvar_dados():
+    armazenamento.compactar()
+
+# Funções para registrar a alteração de uma única entidade
+@instrumentado
+def salvar_veiculo(veiculo):
+    armazenamento.salvar_veiculo(veiculo)
+
+@instrumentado
+def salvar_cliente(cliente):
+    armazenamento.salvar_cliente(cliente)
+
+@instrumentado
+def salvar_locacao(locacao):
+    armazenamento.salvar_locacao(locacao)
+
+def remover_locacao(locacao):
+    armazenamento.remover_locacao(locacao)
+
+# Agrupa as alterações feitas dentro do bloco em uma única gravação
+def lote_de_alteracoes():
+    return armazenamento.lote()
+
+# Seção exclusiva entre threads e processos que usam o mesmo banco: começa atualizando da base
+# os objetos informados. Pode ser aninhada; só a entrada mais externa sincroniza.
+def exclusivo(*objetos):
+    return armazenamento.exclusivo(*objetos)
+
+# Função para migrar o workbook (snapshot + journal) para um banco SQLite
+def migrar_excel_para_sqlite(arquivo_excel=ARQUIVO_DADOS, arquivo_sqlite=ARQUIVO_SQLITE, journal=ARQUIVO_JOURNAL):
+    _reiniciar_memoria()
+    ArmazenamentoExcel(arquivo_excel, journal).carregar()
+    ArmazenamentoSQLite(arquivo_sqlite).gravar_completo()
+    return len(repositorio.listar_veiculos()), len(repositorio.listar_clientes()), len(historico.listar_historico())
+
+# Função para exportar os dados em memória para um workbook Excel (relatórios)
+def exportar_para_excel(arquivo_excel):
+    ArmazenamentoExcel(arquivo_excel, journal=None).gravar_completo()
+
+# Importação em lote--------------------------------------------------------------------------------
+# Campos obrigatórios de cada tipo de registro aceito pela importação
+CAMPOS_IMPORTACAO = {
+    'veiculos': ('modelo', 'marca', 'ano', 'placa', 'tipo', 'categoria'),
+    'clientes': ('nome', 'cpf', 'telefone', 'email'),
+    'locacoes': ('cpf', 'placa', 'data_retirada', 'data_devolucao_prevista'),
+    'devolucoes': ('cpf', 'placa', 'data_devolucao_real')
+}
+
+# Erro de validação de um lote: traz a lista de (linha, mensagem) de todos os registros inválidos
+class ErroImportacao(ValueError):
+    def __init__(self, erros):
+        self.erros = erros
+        super().__init__(f"{len(erros)} registro(s) inválido(s); nenhuma alteração foi aplicada")
+
+# Função para ler registros de um arquivo CSV ou JSONL
+def ler_registros(caminho):
+    if caminho.lower().endswith('.jsonl'):
+        with open(caminho, encoding='utf-8') as arquivo:
+            return [json.loads(linha) for linha in arquivo if linha.strip()]
+    with open(caminho, encoding='utf-8-sig', newline='') as arquivo:
+        return list(csv.DictReader(arquivo))
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, str) and not valor.strip()) or (isinstance(valor, float) and np.isnan(valor))
+
+# Valida os registros sem alterar nada e devolve a lista de operações a aplicar
+def _validar_lote(tipo, registros):
+    erros = []
+    operacoes = []
+    placas_no_lote = set()
+    cpfs_no_lote = set()
+    reservas_no_lote = {}  # Períodos já reservados no lote, por veículo
+    locacoes_no_lote = set()  # Locações já devolvidas no lote
+    saldos_no_lote = {}  # Saldo de pontos de cada cliente depois das devoluções anteriores do lote
+
+    # As datas são convertidas coluna a coluna, de uma vez só; valores inválidos viram NaT
+    datas = {campo: pd.to_datetime(pd.Series([r.get(campo) for r in registros], dtype=object),
+                                   errors='coerce', format='ISO8601').tolist()
+             for campo in CAMPOS_IMPORTACAO[tipo] if campo.startswith('data_')}
+
+    def data(campo, i):
+        valor = datas[campo][i]
+        if valor is pd.NaT:
+            raise ValueError(f"{campo} inválida: {registros[i].get(campo)}")
+        return valor
+
+    for linha, registro in enumerate(registros, start=1):
+        faltando = [campo for campo in CAMPOS_IMPORTACAO[tipo] if _vazio(registro.get(campo))]
+        if faltando:
+            erros.append((linha, f"campos obrigatórios ausentes: {', '.join(faltando)}"))
+            continue
+
+        try:
+            if tipo == 'veiculos':
+                placa = str(registro['placa'])
+                if repositorio.buscar_veiculo(placa) or placa in placas_no_lote:
+                    raise ValueError(f"placa {placa} já cadastrada")
+                placas_no_lote.add(placa)
+                operacoes.append(Veiculo(registro['modelo'], registro['marca'], registro['ano'], placa,
+                                         registro['tipo'], registro['categoria'],
+                                         registro.get('status') or 'disponível'))
+
+            elif tipo == 'clientes':
+                cpf = str(registro['cpf'])
+                if repositorio.buscar_cliente(cpf) or cpf in cpfs_no_lote:
+                    raise ValueError(f"CPF {cpf} já cadastrado")
+                cpfs_no_lote.add(cpf)
+                operacoes.append(Cliente(registro['nome'], cpf, registro['telefone'], registro['email']))
+
+            elif tipo == 'locacoes':
+                cliente = repositorio.buscar_cliente(str(registro['cpf']))
+                veiculo = repositorio.buscar_veiculo(str(registro['placa']))
+                if cliente is None:
+                    raise ValueError(f"cliente {registro['cpf']} não encontrado")
+                if veiculo is None:
+                    raise ValueError(f"veículo {registro['placa']} não encontrado")
+                data_retirada = data('data_retirada', linha - 1)
+                data_prevista = data('data_devolucao_prevista', linha - 1)
+                if data_prevista < data_retirada:
+                    raise ValueError("data de devolução prevista anterior à retirada")
+                # Dentro do lote, um veículo não pode ter períodos que se cruzem nem duas retiradas imediatas
+                imediata = data_retirada <= pd.Timestamp.today()
+                reservas = reservas_no_lote.setdefault(id(veiculo), [])
+                if not veiculo_disponivel(veiculo, data_retirada, data_prevista) or any(
+                        (inicio <= data_prevista and data_retirada <= fim) or (imediata and outra_imediata)
+                        for inicio, fim, outra_imediata in reservas):
+                    raise ValueError(f"veículo {veiculo.placa} não disponível")
+                distancia = None if _vazio(registro.get('distancia_km')) else float(registro['distancia_km'])
+                if distancia is None and (_vazio(registro.get('origem')) or _vazio(registro.get('destino'))):
+                    raise ValueError("informe distancia_km ou origem e destino")
+                reservas.append((data_retirada, data_prevista, imediata))
+                operacoes.append({'cliente': cliente, 'veiculo': veiculo, 'data_retirada': data_retirada,
+                                  'data_devolucao_prevista': data_prevista, 'distancia_km': distancia,
+                                  'origem': registro.get('origem'), 'destino': registro.get('destino')})
+
+            elif tipo == 'devolucoes':
+                locacao = historico.buscar_locacao_aberta(str(registro['cpf']), str(registro['placa']))
+                if locacao is None or id(locacao) in locacoes_no_lote:
+                    raise ValueError("locação não encontrada ou já devolvida")
+                pontos = 0 if _vazio(registro.get('pontos_usados')) else int(registro['pontos_usados'])
+                if pontos < 0:
+                    raise ValueError("pontos_usados não pode ser negativo")
+                saldo = saldos_no_lote.get(id(locacao.cliente), locacao.cliente.pontos_fidelidade)
+                if pontos > saldo:
+                    raise ValueError(f"pontos insuficientes: o cliente {locacao.cliente.cpf} tem {saldo} ponto(s)")
+                if data('data_devolucao_real', linha - 1) < pd.Timestamp(locacao.data_retirada):
+                    raise ValueError("data de devolução anterior à retirada")
+                locacoes_no_lote.add(id(locacao))
+                saldos_no_lote[id(locacao.cliente)] = saldo - pontos
+                operacoes.append((locacao, data('data_devolucao_real', linha - 1), pontos))
+        except (ValueError, TypeError) as e:
+            erros.append((linha, str(e)))
+
+    if erros:
+        raise ErroImportacao(erros)
+    return operacoes
+
+# Função para importar um lote de registros (veiculos, clientes, locacoes ou devolucoes).
+# O lote é validado por inteiro antes de qualquer alteração e gravado no journal como uma
+# única unidade; se algo falhar na aplicação, os dados são recarregados do disco.
+def importar_registros(tipo, registros, chave_api=None, verboso=False):
+    if tipo not in CAMPOS_IMPORTACAO:
+        raise ValueError(f"Tipo de importação desconhecido: {tipo}")
+    operacoes = _validar_lote(tipo, registros)
+
+    # As distâncias que faltam são consultadas de uma vez, agrupadas em poucas requisições
+    if tipo == 'locacoes':
+        sem_distancia = [op for op in operacoes if op['distancia_km'] is None]
+        if sem_distancia:
+            pares = [(op['origem'], op['destino']) for op in sem_distancia]
+            resultados = calcular_distancias_em_lote(pares, chave_api or API_KEY)
+            estimativas = estimador_distancia.estimar([o for o, _ in pares], [d for _, d in pares])
+            for op, resultado, estimativa in zip(sem_distancia, resultados, estimativas):
+                if resultado['distancia_km'] is not None:
+                    op['distancia_km'] = resultado['distancia_km']
+                elif not np.isnan(estimativa):
+                    op['distancia_km'], op['distancia_estimada'] = float(estimativa), True
+                else:
+                    raise ErroImportacao([(None, f"distância indisponível para {op['origem']} -> {op['destino']}: {resultado['erro']}")])
+
+    saida = sys.stdout if verboso else open(os.devnull, 'w')
+    try:
+        with redirect_stdout(saida), lote_de_alteracoes():
+            for op in operacoes:
+                if tipo == 'veiculos':
+                    adicionar_veiculo(op)
+                elif tipo == 'clientes':
+                    adicionar_cliente(op)
+                elif tipo == 'locacoes':
+                    alugar_veiculo(op['cliente'], op['veiculo'], op['data_retirada'], op['data_devolucao_prevista'],
+                                   op['origem'], op['destino'], chave_api,
+                                   distancia_km=op['distancia_km'], distancia_estimada=op.get('distancia_estimada', False))
+                else:
+                    devolver_veiculo(*op)
+    except Exception:
+        # O journal não recebeu o lote; volta a memória ao estado gravado
+        carregar_dados()
+        raise
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+    return len(operacoes)
+
+# Função para importar um arquivo CSV ou JSONL
+def importar_arquivo(tipo, caminho, chave_api=None, verboso=False):
+    return importar_registros(tipo, ler_registros(caminho), chave_api, verboso)
+
+# Função de linha de comando (uso não interativo)
+def executar_linha_de_comando(argumentos):
+    parser = argparse.ArgumentParser(description="Sistema de locação de veículos")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    importar = subcomandos.add_parser('importar', help="Importa um arquivo CSV ou JSONL em lote")
+    importar.add_argument('tipo', choices=sorted(CAMPOS_IMPORTACAO))
+    importar.add_argument('arquivos', nargs='+')
+    importar.add_argument('--verboso', action='store_true', help="Exibe as mensagens de cada operação")
+    subcomandos.add_parser('compactar', help="Grava o snapshot completo e esvazia o journal")
+    migrar = subcomandos.add_parser('migrar', help="Copia o workbook Excel (e o journal) para o banco SQLite")
+    migrar.add_argument('--excel', default=ARQUIVO_DADOS)
+    migrar.add_argument('--sqlite', default=ARQUIVO_SQLITE)
+    exportar = subcomandos.add_parser('exportar', help="Exporta os dados para um workbook Excel")
+    exportar.add_argument('arquivo')
+    subcomandos.add_parser('conferir', help="Confere os agregados contra uma reconstrução a partir do histórico")
+    listar = subcomandos.add_parser('listar', help="Lista veículos, clientes ou locações (ou exporta para CSV/JSONL)")
+    listar.add_argument('tipo', choices=['veiculos', 'clientes', 'locacoes'])
+    listar.add_argument('--ordenar', help="Campo usado na ordenação")
+    listar.add_argument('--decrescente', action='store_true')
+    listar.add_argument('--inicio', type=int, default=0, help="Quantidade de registros a pular")
+    listar.add_argument('--limite', type=int, help="Quantidade máxima de registros")
+    listar.add_argument('--saida', help="Arquivo .csv ou .jsonl para exportar em vez de imprimir")
+    args = parser.parse_args(argumentos)
+
+    if args.comando == 'migrar':
+        veiculos, clientes, locacoes = migrar_excel_para_sqlite(args.excel, args.sqlite)
+        print(f"Migrados {veiculos} veículos, {clientes} clientes e {locacoes} locações para {args.sqlite}.")
+        return 0
+
+    carregar_dados()
+    if args.comando == 'compactar':
+        salvar_dados()
+        print("Snapshot gravado.")
+        return 0
+    if args.comando == 'exportar':
+        exportar_para_excel(args.arquivo)
+        print(f"Dados exportados para {args.arquivo}.")
+        return 0
+    if args.comando == 'listar':
+        paginacao = {'ordenar_por': args.ordenar, 'decrescente': args.decrescente, 'inicio': args.inicio, 'limite': args.limite}
+        if args.tipo == 'veiculos':
+            registros = iterar_veiculos(**paginacao)
+        elif args.tipo == 'clientes':
+            registros = iterar_clientes(**paginacao)
+        else:
+            registros = iterar_locacoes(**paginacao)
+        if args.saida:
+            print(f"{exportar_registros(registros, args.saida)} registro(s) exportado(s) para {args.saida}.")
+        else:
+            imprimir_paginas(registros)
+        return 0
+    if args.comando == 'conferir':
+        divergencias = agregados.conferir(repositorio, historico)
+        for divergencia in divergencias:
+            print(divergencia)
+        print("Agregados conferem com o histórico." if not divergencias else f"{len(divergencias)} divergência(s).")
+        return 1 if divergencias else 0
+
+    for caminho in args.arquivos:
+        inicio = time.perf_counter()
+        try:
+            quantidade = importar_arquivo(args.tipo, caminho, API_KEY, args.verboso)
+        except ErroImportacao as e:
+            print(f"{caminho}: {e}")
+            for linha, mensagem in e.erros[:50]:
+                print(f"  linha {linha}: {mensagem}")
+            return 1
+        except (ErroConcorrencia, ValueError) as e:
+            # O banco mudou em outro processo entre a validação e a gravação; nada do lote foi gravado
+            print(f"{caminho}: {e}")
+            return 1
+        print(f"{caminho}: {quantidade} registro(s) de {args.tipo} importado(s) em {time.perf_counter() - inicio:.2f}s")
+    return 0
 
 # Função para exibir o menu principal
 def menu():
@@ -333,137 +2682,177 @@ def menu():
         print("10. Relatório de Quantidade de Veículos")
         print("11. Buscar Locações")
         print("12. Sair")
+        print("13. Relatório de Receita")
         escolha = input("Escolha uma opção: ")
 
-        if escolha == "1":
-            modelo = input("Modelo: ")
-            marca = input("Marca: ")
-            ano = input("Ano: ")
-            placa = input("Placa: ")
-            tipo = input("Tipo (carro/moto): ")
-            categoria = input("Categoria (Ferro/Ouro/Premium): ")
-            veiculo = Veiculo(modelo, marca, ano, placa, tipo, categoria)
-            adicionar_veiculo(veiculo)
-            print(f"Veículo {placa} cadastrado com sucesso.")
-        elif escolha == "2":
-            listar_veiculos()
-        elif escolha == "3":
-            placa = input("Placa do veículo a ser marcado em manutenção: ")
-            veiculo = next((v for v in veiculos if v.placa == placa), None)
-            if veiculo:
-                veiculo.status = 'em manutenção'
-                salvar_dados()
-                print(f"Veículo {placa} marcado como em manutenção.")
-            else:
-                print("Veículo não encontrado.")
-        elif escolha == "4":
-            placa = input("Placa do veículo a ser retirado da manutenção: ")
-            veiculo = next((v for v in veiculos if v.placa == placa), None)
-            if veiculo:
-                veiculo.status = 'disponível'
-                salvar_dados()
-                print(f"Veículo {placa} concluído de manutenção e está disponível.")
-            else:
-                print("Veículo não encontrado.")
-        elif escolha == "5":
-            nome = input("Nome: ")
-            cpf = input("CPF: ")
-            telefone = input("Telefone: ")
-            email = input("Email: ")
-            cliente = Cliente(nome, cpf, telefone, email)
-            clientes.append(cliente)
-            salvar_dados()
-            print(f"Cliente {nome} adicionado com sucesso!")
-        elif escolha == "6":
-            df_clientes = pd.DataFrame([vars(c) for c in clientes])
-            print("\nListagem de Clientes:")
-            print(df_clientes.to_string(index=False))
-        elif escolha == "7":
-            cpf = input("CPF do cliente: ")
-            cliente = next((c for c in clientes if c.cpf == cpf), None)
-            if cliente:
-                origem = input("Qual é a origem da viagem? ")
-                destino = input("Qual é o destino da sua viagem? ")
-                data_retirada = pd.to_datetime(input("Data de Retirada (YYYY-MM-DD): "))
-                data_devolucao_prevista = pd.to_datetime(input("Data de Devolução Prevista (YYYY-MM-DD): "))
-                tipo = input("Filtrar por Tipo (carro/moto) [pressione Enter para todos]: ")
-                categoria = input("Filtrar por Categoria (Ferro/Ouro/Premium) [pressione Enter para todos]: ")
-                buscar_veiculos(tipo=tipo if tipo else None, status='disponível', categoria=categoria if categoria else None)
-
-                placa = input("Placa do veículo que deseja alugar: ")
-                veiculo = next((v for v in veiculos if v.placa == placa), None)
+        try:
+            if escolha == "1":
+                modelo = input("Modelo: ")
+                marca = input("Marca: ")
+                ano = input("Ano: ")
+                placa = input("Placa: ")
+                tipo = input("Tipo (carro/moto): ")
+                categoria = input("Categoria (Ferro/Ouro/Premium): ")
+                try:
+                    adicionar_veiculo(Veiculo(modelo, marca, ano, placa, tipo, categoria))
+                    print(f"Veículo {placa} cadastrado com sucesso.")
+                except ValueError as e:
+                    print(e)
+            elif escolha == "2":
+                listar_veiculos(pausar=True)
+            elif escolha == "3":
+                placa = input("Placa do veículo a ser marcado em manutenção: ")
+                veiculo = repositorio.buscar_veiculo(placa)
                 if veiculo:
+                    alterar_status_veiculo(veiculo, 'em manutenção')
+                    print(f"Veículo {placa} marcado como em manutenção.")
+                else:
+                    print("Veículo não encontrado.")
+            elif escolha == "4":
+                placa = input("Placa do veículo a ser retirado da manutenção: ")
+                veiculo = repositorio.buscar_veiculo(placa)
+                if veiculo:
+                    alterar_status_veiculo(veiculo, 'disponível')
+                    print(f"Veículo {placa} concluído de manutenção e está disponível.")
+                else:
+                    print("Veículo não encontrado.")
+            elif escolha == "5":
+                nome = input("Nome: ")
+                cpf = input("CPF: ")
+                telefone = input("Telefone: ")
+                email = input("Email: ")
+                cliente = Cliente(nome, cpf, telefone, email)
+                try:
+                    adicionar_cliente(cliente)
+                    print(f"Cliente {nome} adicionado com sucesso!")
+                except ValueError as e:
+                    print(e)
+            elif escolha == "6":
+                print("\nListagem de Clientes:")
+                imprimir_paginas(iterar_clientes(), pausar=True)
+            elif escolha == "7":
+                cpf = input("CPF do cliente: ")
+                cliente = repositorio.buscar_cliente(cpf)
+                if cliente:
+                    origem = input("Qual é a origem da viagem? ")
+                    destino = input("Qual é o destino da sua viagem? ")
+                    try:
+                        estimativa, custo_estimado = estimar_distancia_e_custo(origem, destino)
+                        print(f"Cotação preliminar: {estimativa:.2f} km (estimada), R${custo_estimado:.2f} de taxa por km.")
+                    except ValueError:
+                        pass
+                    data_retirada = pd.to_datetime(input("Data de Retirada (YYYY-MM-DD): "))
+                    data_devolucao_prevista = pd.to_datetime(input("Data de Devolução Prevista (YYYY-MM-DD): "))
+                    tipo = input("Filtrar por Tipo (carro/moto) [pressione Enter para todos]: ")
+                    categoria = input("Filtrar por Categoria (Ferro/Ouro/Premium) [pressione Enter para todos]: ")
+                    livres = veiculos_livres(data_retirada, data_devolucao_prevista, tipo=tipo, categoria=categoria)
+                    if livres:
+                        print("\nVeículos livres no período:")
+                        print(pd.DataFrame([v.para_dict() for v in livres]).to_string(index=False))
+                    else:
+                        print("Nenhum veículo livre no período com os filtros fornecidos.")
+
+                    placa = input("Placa do veículo que deseja alugar: ")
+                    veiculo = repositorio.buscar_veiculo(placa)
+                    if veiculo:
+                        try:
+                            locacao = alugar_veiculo(cliente, veiculo, data_retirada, data_devolucao_prevista, origem, destino, API_KEY)
+                            print(f"Veículo {veiculo.placa} alugado com sucesso!")
+                        except ValueError as e:
+                            print(e)
+                    else:
+                        print("Veículo não encontrado.")
+                else:
+                    print("Cliente não encontrado.")
+            elif escolha == "8":
+                cpf = input("CPF do cliente: ")
+                placa = input("Placa do veículo: ")
+                locacao = historico.buscar_locacao_aberta(cpf, placa)
+                if locacao and pd.Timestamp(locacao.data_retirada) > pd.Timestamp.today():
+                    # Reserva que ainda não começou: não há devolução, só cancelamento
+                    if input(f"A reserva começa em {locacao.data_retirada:%Y-%m-%d}. Deseja cancelá-la? [s/n]: ").strip().lower() == 's':
+                        try:
+                            cancelar_reserva(locacao)
+                        except ValueError as e:
+                            print(e)
+                elif locacao:
+                    data_devolucao_real = pd.to_datetime(input("Data de Devolução Real (YYYY-MM-DD): "))
+                    # Pergunta ao usuário se deseja usar os pontos de fidelidade
+                    usar_pontos = input(f"Você deseja usar seus pontos de fidelidade para um desconto? (Você tem {locacao.cliente.pontos_fidelidade} pontos disponíveis) [s/n]: ").strip().lower()
+                    pontos_usados = int(input("Quantos pontos você deseja usar? ")) if usar_pontos == 's' else 0
                     try:
-                        locacao = alugar_veiculo(cliente, veiculo, data_retirada, data_devolucao_prevista, origem, destino, API_KEY)
-                        print(f"Veículo {veiculo.placa} alugado com sucesso!")
+                        devolver_veiculo(locacao, data_devolucao_real, pontos_usados)
                     except ValueError as e:
                         print(e)
                 else:
-                    print("Veículo não encontrado.")
-            else:
-                print("Cliente não encontrado.")
-        elif escolha == "8":
-            cpf = input("CPF do cliente: ")
-            placa = input("Placa do veículo: ")
-            data_devolucao_real = pd.to_datetime(input("Data de Devolução Real (YYYY-MM-DD): "))
-            locacao = next((l for l in historico.listar_historico()
-                            if l.cliente.cpf == cpf and l.veiculo.placa == placa and l.data_devolucao_real is None), None)
-            if locacao:
-                devolver_veiculo(locacao, data_devolucao_real)
+                    print("Locação não encontrada ou já devolvida.")
+            elif escolha == "9":
+                data_inicio = input("Período - Data Início (YYYY-MM-DD) [pressione Enter para todos]: ")
+                data_fim = input("Período - Data Fim (YYYY-MM-DD) [pressione Enter para todos]: ")
+                posicoes = None
+                if data_inicio or data_fim:
+                    # Locações que estiveram em andamento em algum momento do período
+                    posicoes = historico.posicoes_sobrepostas(pd.to_datetime(data_inicio) if data_inicio else None,
+                                                              pd.to_datetime(data_fim) if data_fim else None)
+                    posicoes.sort()
+                print("\nRelatório de Locações:")
+                campos = ('Cliente', 'Veículo', 'Data Retirada', 'Data Devolução Prevista', 'Data Devolução Real')
+                imprimir_paginas(({campo: registro[campo] for campo in campos} for registro in historico.iterar(posicoes)),
+                                 pausar=True)
+            elif escolha == "10":
+                df_veiculos = pd.DataFrame({
+                    'Status': ['Alugados', 'Disponíveis', 'Em Manutenção'],
+                    'Quantidade': [agregados.por_status['alugado'], agregados.por_status['disponível'],
+                                   agregados.por_status['em manutenção']]
+                })
+                print("\nRelatório de Veículos:")
+                print(df_veiculos.to_string(index=False))
+                print("\nPor categoria:")
+                print(pd.DataFrame(sorted((+agregados.por_categoria).items()), columns=['Categoria', 'Quantidade']).to_string(index=False))
+                print("\nPor tipo:")
+                print(pd.DataFrame(sorted((+agregados.por_tipo).items()), columns=['Tipo', 'Quantidade']).to_string(index=False))
+            elif escolha == "11":
+                nome_cliente = input("Nome do Cliente [pressione Enter para todos]: ")
+                cpf_cliente = input("CPF do Cliente [pressione Enter para todos]: ")
+                placa_veiculo = input("Placa do Veículo [pressione Enter para todos]: ")
+                tipo_veiculo = input("Tipo do Veículo [pressione Enter para todos]: ")
+                categoria_veiculo = input("Categoria do Veículo [pressione Enter para todos]: ")
+                data_inicio = input("Data Início (YYYY-MM-DD) [pressione Enter para todos]: ")
+                data_fim = input("Data Fim (YYYY-MM-DD) [pressione Enter para todos]: ")
+
+                data_inicio = pd.to_datetime(data_inicio) if data_inicio else None
+                data_fim = pd.to_datetime(data_fim) if data_fim else None
+
+                buscar_locacoes(
+                    nome_cliente=nome_cliente if nome_cliente else None,
+                    cpf_cliente=cpf_cliente if cpf_cliente else None,
+                    placa_veiculo=placa_veiculo if placa_veiculo else None,
+                    tipo_veiculo=tipo_veiculo if tipo_veiculo else None,
+                    categoria_veiculo=categoria_veiculo if categoria_veiculo else None,
+                    data_inicio=data_inicio,
+                    data_fim=data_fim,
+                    pausar=True
+                )
+            elif escolha == "13":
+                periodo = input("Agrupar por dia ou mês? [d/m]: ").strip().lower()
+                df_receita = agregados.receita('diario' if periodo == 'd' else 'mensal')
+                print("\nRelatório de Receita:")
+                print(df_receita.to_string(index=False) if len(df_receita) else "Nenhuma receita registrada.")
+            elif escolha == "12":
+                salvar_dados()
+                print("Dados salvos e programa encerrado.")
+                if instrumentacao.ativa:
+                    instrumentacao.exibir()
+                break
             else:
-                print("Locação não encontrada ou já devolvida.")
-        elif escolha == "9":
-            print("\nRelatório de Locações:")
-            locacoes = historico.listar_historico()
-            df_locacoes = pd.DataFrame([{
-                'Cliente': l.cliente.nome,
-                'Veículo': l.veiculo.modelo,
-                'Data Retirada': l.data_retirada,
-                'Data Devolução Prevista': l.data_devolucao_prevista,
-                'Data Devolução Real': l.data_devolucao_real
-            } for l in locacoes])
-            print(df_locacoes.to_string(index=False))
-        elif escolha == "10":
-            qtd_alugados = sum(v.status == 'alugado' for v in veiculos)
-            qtd_disponiveis = sum(v.status == 'disponível' for v in veiculos)
-            qtd_manutencao = sum(v.status == 'em manutenção' for v in veiculos)
-            df_veiculos = pd.DataFrame({
-                'Status': ['Alugados', 'Disponíveis', 'Em Manutenção'],
-                'Quantidade': [qtd_alugados, qtd_disponiveis, qtd_manutencao]
-            })
-            print("\nRelatório de Veículos:")
-            print(df_veiculos.to_string(index=False))
-        elif escolha == "11":
-            nome_cliente = input("Nome do Cliente [pressione Enter para todos]: ")
-            cpf_cliente = input("CPF do Cliente [pressione Enter para todos]: ")
-            placa_veiculo = input("Placa do Veículo [pressione Enter para todos]: ")
-            tipo_veiculo = input("Tipo do Veículo [pressione Enter para todos]: ")
-            categoria_veiculo = input("Categoria do Veículo [pressione Enter para todos]: ")
-            data_inicio = input("Data Início (YYYY-MM-DD) [pressione Enter para todos]: ")
-            data_fim = input("Data Fim (YYYY-MM-DD) [pressione Enter para todos]: ")
-
-            data_inicio = pd.to_datetime(data_inicio) if data_inicio else None
-            data_fim = pd.to_datetime(data_fim) if data_fim else None
-
-            buscar_locacoes(
-                nome_cliente=nome_cliente if nome_cliente else None,
-                cpf_cliente=cpf_cliente if cpf_cliente else None,
-                placa_veiculo=placa_veiculo if placa_veiculo else None,
-                tipo_veiculo=tipo_veiculo if tipo_veiculo else None,
-                categoria_veiculo=categoria_veiculo if categoria_veiculo else None,
-                data_inicio=data_inicio,
-                data_fim=data_fim
-            )
-        elif escolha == "12":
-            salvar_dados()
-            print("Dados salvos e programa encerrado.")
-            break
-        else:
-            print("Opção inválida. Tente novamente.")
+                print("Opção inválida. Tente novamente.")
+        except ErroConcorrencia as e:
+            # As operações já recarregam e se repetem; chega aqui só se o banco mudou em todas as tentativas
+            print(f"{e}. Recarregando os dados...")
+            carregar_dados()
 
-# Executa o menu
+# Executa o menu (ou a linha de comando, quando há argumentos)
 if __name__ == "__main__":
-    # Inicializa as listas globais de veículos e clientes
-    veiculos = []
-    clientes = []
+    if len(sys.argv) > 1:
+        sys.exit(executar_linha_de_comando(sys.argv[1:]))
     menu()
\ No newline at end of file
@@ -0,0 +1,686 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import Código as sistema
+
+# Valores usados na geração de dados sintéticos------------------------------------------------
+TIPOS = ['carro', 'moto']
+CATEGORIAS = ['Ferro', 'Ouro', 'Premium']
+MARCAS = ['Honda', 'Toyota', 'Ford', 'Chevrolet', 'Fiat', 'Yamaha']
+
+# Função para gerar um banco de dados sintético com N veículos, M clientes e K locações
+def gerar_dados_sinteticos(n_veiculos, n_clientes, n_locacoes, semente=42):
+    rng = np.random.default_rng(semente)
+
+    df_veiculos = pd.DataFrame({
+        'modelo': [f'Modelo {i}' for i in range(n_veiculos)],
+        'marca': rng.choice(MARCAS, n_veiculos),
+        'ano': rng.integers(2010, 2025, n_veiculos),
+        'placa': [f'{chr(65 + i // 260000 % 26)}{chr(65 + i // 10000 % 26)}{chr(65 + i // 100 % 26)}{i % 10000:04d}'
+                  for i in range(n_veiculos)],
+        'tipo': rng.choice(TIPOS, n_veiculos),
+        'categoria': rng.choice(CATEGORIAS, n_veiculos),
+        'status': 'disponível'
+    })
+
+    df_clientes = pd.DataFrame({
+        'nome': [f'Cliente {i}' for i in range(n_clientes)],
+        'cpf': [f'{i:011d}' for i in range(n_clientes)],
+        'telefone': '(11) 90000-0000',
+        'email': [f'cliente{i}@email.com' for i in range(n_clientes)],
+        'pontos_fidelidade': 0
+    })
+
+    retiradas = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, n_locacoes), unit='D')
+    previstas = retiradas + pd.to_timedelta(rng.integers(1, 15, n_locacoes), unit='D')
+    reais = previstas + pd.to_timedelta(rng.integers(-1, 3, n_locacoes), unit='D')
+    idx_clientes = rng.integers(0, n_clientes, n_locacoes)
+    df_locacoes = pd.DataFrame({
+        'nome': df_clientes['nome'].to_numpy()[idx_clientes],
+        'cpf': df_clientes['cpf'].to_numpy()[idx_clientes],
+        'placa': df_veiculos['placa'].to_numpy()[rng.integers(0, n_veiculos, n_locacoes)],
+        'data_retirada': retiradas,
+        'data_devolucao_prevista': previstas,
+        'data_devolucao_real': reais,
+        'distancia_km': rng.uniform(5, 800, n_locacoes).round(2)
+    })
+    return df_veiculos, df_clientes, df_locacoes
+
+# Função para gravar os dados sintéticos no formato do banco de dados do sistema
+def gravar_banco_sintetico(caminho, n_veiculos, n_clientes, n_locacoes, semente=42):
+    df_veiculos, df_clientes, df_locacoes = gerar_dados_sinteticos(n_veiculos, n_clientes, n_locacoes, semente)
+    with pd.ExcelWriter(caminho, engine='openpyxl') as writer:
+        df_veiculos.to_excel(writer, sheet_name='Veiculos', index=False)
+        df_clientes.to_excel(writer, sheet_name='Clientes', index=False)
+        df_locacoes.to_excel(writer, sheet_name='Locacoes', index=False)
+
+# Aponta o sistema para um banco de dados em um diretório temporário
+def usar_banco(diretorio, tipo='excel'):
+    if tipo == 'sqlite':
+        sistema.armazenamento = sistema.ArmazenamentoSQLite(os.path.join(diretorio, 'banco de dados.sqlite'))
+    else:
+        sistema.armazenamento = sistema.ArmazenamentoExcel(os.path.join(diretorio, 'banco de dados.xlsx'),
+                                                           os.path.join(diretorio, 'banco de dados.journal'))
+
+# Mede o tempo de inicialização (carregar_dados) para cada tamanho de histórico
+def medir_carregamento(tamanhos, n_veiculos=500, n_clientes=2000):
+    resultados = []
+    for n_locacoes in tamanhos:
+        with tempfile.TemporaryDirectory() as diretorio:
+            usar_banco(diretorio)
+            gravar_banco_sintetico(sistema.armazenamento.arquivo, n_veiculos, n_clientes, n_locacoes)
+
+            inicio = time.perf_counter()
+            sistema.carregar_dados()
+            duracao = time.perf_counter() - inicio
+
+        resultados.append({
+            'locacoes': n_locacoes,
+            'segundos': round(duracao, 4),
+            'locacoes_carregadas': len(sistema.historico.listar_historico())
+        })
+    return pd.DataFrame(resultados)
+
+# Compara os armazenamentos Excel e SQLite: carregamento, gravação de uma alteração e snapshot completo
+def medir_armazenamento(tamanhos, n_veiculos=500, n_clientes=2000):
+    resultados = []
+    for n_locacoes in tamanhos:
+        with tempfile.TemporaryDirectory() as diretorio:
+            usar_banco(diretorio)
+            gravar_banco_sintetico(sistema.armazenamento.arquivo, n_veiculos, n_clientes, n_locacoes)
+            sistema.migrar_excel_para_sqlite(sistema.armazenamento.arquivo, os.path.join(diretorio, 'banco de dados.sqlite'),
+                                             sistema.armazenamento.journal)
+
+            for tipo in ('excel', 'sqlite'):
+                usar_banco(diretorio, tipo)
+                inicio = time.perf_counter()
+                sistema.carregar_dados()
+                carregamento = time.perf_counter() - inicio
+
+                cliente = sistema.repositorio.listar_clientes()[0]
+                inicio = time.perf_counter()
+                for _ in range(100):
+                    cliente.pontos_fidelidade += 1
+                    sistema.salvar_cliente(cliente)
+                alteracao = (time.perf_counter() - inicio) / 100
+
+                inicio = time.perf_counter()
+                sistema.salvar_dados()
+                snapshot = time.perf_counter() - inicio
+
+                resultados.append({'armazenamento': tipo, 'locacoes': n_locacoes,
+                                   'carregar_s': round(carregamento, 4),
+                                   'alteracao_ms': round(alteracao * 1000, 3),
+                                   'salvar_dados_s': round(snapshot, 4)})
+    return pd.DataFrame(resultados)
+
+# Compara a precificação objeto a objeto (calcular_multa/calcular_preco_total/acumular_pontos) com a
+# precificação em lote e confere que os resultados são idênticos
+def medir_precificacao(tamanhos, n_veiculos=500, n_clientes=2000, semente=42):
+    resultados = []
+    for n_locacoes in tamanhos:
+        df_veiculos, _, df_locacoes = gerar_dados_sinteticos(n_veiculos, n_clientes, n_locacoes, semente)
+        categorias = df_veiculos.set_index('placa')['categoria'][df_locacoes['placa']].to_numpy()
+        # Parte das locações ainda em aberto, para exercitar a regra da multa
+        reais = df_locacoes['data_devolucao_real'].where(np.arange(n_locacoes) % 7 != 0)
+
+        inicio = time.perf_counter()
+        por_objeto = []
+        for categoria, retirada, prevista, real, distancia in zip(
+                categorias, df_locacoes['data_retirada'], df_locacoes['data_devolucao_prevista'],
+                reais.tolist(), df_locacoes['distancia_km']):
+            locacao = sistema.Locacao(None, sistema.Veiculo('', '', 0, '', 'carro', categoria), retirada, prevista,
+                                      distancia_km=distancia)
+            locacao.data_devolucao_real = None if real is pd.NaT else real
+            multa = locacao.calcular_multa()
+            preco_base, total = locacao.calcular_preco_total(multa)
+            por_objeto.append((preco_base, multa, total, int(preco_base // 10)))
+        duracao_objetos = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        em_lote = sistema.precificar_em_lote(categorias, df_locacoes['data_retirada'], df_locacoes['data_devolucao_prevista'],
+                                             reais, df_locacoes['distancia_km'])
+        duracao_lote = time.perf_counter() - inicio
+
+        resultados.append({'locacoes': n_locacoes, 'objeto_a_objeto_s': round(duracao_objetos, 4),
+                           'em_lote_s': round(duracao_lote, 4),
+                           'identicos': por_objeto == list(em_lote.itertuples(index=False, name=None))})
+    return pd.DataFrame(resultados)
+
+# Representação anterior dos registros (objeto comum com __dict__ e datas em Timestamp), usada como
+# referência no benchmark de memória
+class _RegistroComDicionario:
+    def __init__(self, **campos):
+        self.__dict__.update(campos)
+
+# Bytes ainda alocados quando a função retorna (o resultado dela continua vivo durante a medição)
+def _bytes_alocados(funcao):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        resultado = funcao()  # noqa: F841 (mantém o resultado vivo até a medição)
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+# Mede os bytes por registro de veículos, clientes e locações na representação anterior e na atual.
+# Na atual, as locações incluem a parte das colunas do histórico onde passaram a ficar datas e distância
+# (os índices de busca ficam de fora: existem nas duas representações). As locações se repartem entre
+# uma frota e uma carteira de clientes 100 vezes menores que o histórico.
+def medir_memoria(n=100000, semente=42):
+    df_veiculos, df_clientes, df_locacoes = gerar_dados_sinteticos(n, n, n, semente)
+    colunas_veiculo = list(sistema.Veiculo.CAMPOS)
+    colunas_cliente = ['nome', 'cpf', 'telefone', 'email']
+    colunas_locacao = ['data_retirada', 'data_devolucao_prevista', 'data_devolucao_real', 'distancia_km']
+    frota = max(n // 100, 1)
+    clientes = [sistema.Cliente(*campos) for campos in zip(*(df_clientes[c].tolist() for c in colunas_cliente))]
+    veiculos = [sistema.Veiculo(*campos) for campos in zip(*(df_veiculos[c].tolist() for c in colunas_veiculo))]
+
+    def veiculos_antes():
+        return [_RegistroComDicionario(**dict(zip(colunas_veiculo, campos)))
+                for campos in zip(*(df_veiculos[c].tolist() for c in colunas_veiculo))]
+
+    def veiculos_depois():
+        return [sistema.Veiculo(*campos) for campos in zip(*(df_veiculos[c].tolist() for c in colunas_veiculo))]
+
+    def clientes_antes():
+        return [_RegistroComDicionario(**dict(zip(colunas_cliente, campos)), pontos_fidelidade=0)
+                for campos in zip(*(df_clientes[c].tolist() for c in colunas_cliente))]
+
+    def clientes_depois():
+        return [sistema.Cliente(*campos) for campos in zip(*(df_clientes[c].tolist() for c in colunas_cliente))]
+
+    def locacoes_antes():
+        return [_RegistroComDicionario(cliente=clientes[i % frota], veiculo=veiculos[i % frota], data_retirada=retirada,
+                                       data_devolucao_prevista=prevista, _historico=None, _indice=i,
+                                       _data_devolucao_real=real, distancia_km=distancia, taxa_por_km=0.50,
+                                       distancia_estimada=False)
+                for i, (retirada, prevista, real, distancia) in enumerate(zip(*(df_locacoes[c].tolist() for c in colunas_locacao)))]
+
+    def locacoes_depois():
+        historico = sistema.HistoricoLocacao(capacidade=n)
+        for i, (retirada, prevista, real, distancia) in enumerate(zip(*(df_locacoes[c].tolist() for c in colunas_locacao))):
+            locacao = sistema.Locacao(clientes[i % frota], veiculos[i % frota], retirada, prevista, distancia_km=distancia)
+            locacao.data_devolucao_real = real
+            historico._adicionar_locacao(locacao, indexar=False)
+        return historico
+
+    resultados = []
+    for registro, antes, depois in (('Veiculo', veiculos_antes, veiculos_depois), ('Cliente', clientes_antes, clientes_depois),
+                                    ('Locacao', locacoes_antes, locacoes_depois)):
+        bytes_antes = _bytes_alocados(antes) / n
+        bytes_depois = _bytes_alocados(depois) / n
+        resultados.append({'registro': registro, 'bytes_antes': round(bytes_antes), 'bytes_depois': round(bytes_depois),
+                           'reducao_%': round(100 * (1 - bytes_depois / bytes_antes), 1)})
+    return pd.DataFrame(resultados)
+
+# Conta pares de locações do mesmo veículo cujos períodos se cruzam
+def contar_sobreposicoes(historico):
+    periodos = {}
+    for locacao in historico.listar_historico():
+        fim = locacao.data_devolucao_real if locacao.data_devolucao_real is not None else locacao.data_devolucao_prevista
+        periodos.setdefault(id(locacao.veiculo), []).append((locacao.data_retirada, fim))
+    sobreposicoes = 0
+    for lista in periodos.values():
+        lista.sort()
+        maior_fim = None
+        for inicio, fim in lista:
+            sobreposicoes += maior_fim is not None and inicio <= maior_fim
+            maior_fim = fim if maior_fim is None else max(maior_fim, fim)
+    return sobreposicoes
+
+# Mede a consulta de veículos livres em um período (agenda por veículo) para cada tamanho de histórico
+def medir_disponibilidade(tamanhos, n_veiculos=500, n_clientes=2000, n_consultas=200):
+    resultados = []
+    for n_locacoes in tamanhos:
+        with tempfile.TemporaryDirectory() as diretorio:
+            usar_banco(diretorio)
+            gravar_banco_sintetico(sistema.armazenamento.arquivo, n_veiculos, n_clientes, n_locacoes)
+            sistema.carregar_dados()
+
+        rng = np.random.default_rng(0)
+        inicios = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, n_consultas), unit='D')
+        inicio = time.perf_counter()
+        livres = sum(len(sistema.veiculos_livres(d, d + pd.Timedelta(days=7), tipo='carro')) for d in inicios)
+        duracao = time.perf_counter() - inicio
+        resultados.append({'locacoes': n_locacoes, 'ms_por_consulta': round(duracao / n_consultas * 1000, 3),
+                           'livres_em_media': round(livres / n_consultas, 1)})
+    return pd.DataFrame(resultados)
+
+# Teste de estresse: vários balcões (threads) alugam e devolvem ao mesmo tempo, disputando poucos veículos.
+# Verifica que nenhum veículo fica com duas locações abertas, que nenhuma alteração se perde
+# (memória e banco recarregado conferem com o que as threads registraram) e que os pontos fecham.
+def testar_concorrencia(n_threads=16, n_operacoes=500, n_veiculos=10, n_clientes=50, tipo='sqlite', semente=42):
+    with tempfile.TemporaryDirectory() as diretorio:
+        usar_banco(diretorio, tipo)
+        df_veiculos, df_clientes, _ = gerar_dados_sinteticos(n_veiculos, n_clientes, 0, semente)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            sistema.carregar_dados()
+            for registro in df_veiculos.to_dict('records'):
+                sistema.adicionar_veiculo(sistema.Veiculo(**registro))
+            for registro in df_clientes.to_dict('records'):
+                sistema.adicionar_cliente(sistema.Cliente(registro['nome'], registro['cpf'], registro['telefone'], registro['email']))
+
+        veiculos = sistema.repositorio.listar_veiculos()
+        clientes = sistema.repositorio.listar_clientes()
+        trava = threading.Lock()
+        em_uso = {}  # Locações abertas por veículo, segundo as threads
+        sequencia = iter(range(n_threads * n_operacoes))  # Datas de retirada distintas para cada locação
+        contagem = {'alugueis': 0, 'recusas': 0, 'devolucoes': 0, 'duplas': 0, 'pontos': 0}
+
+        def balcao(indice):
+            rng = random.Random(semente + indice)
+            minhas = []
+            for _ in range(n_operacoes):
+                if minhas and rng.random() < 0.5:
+                    locacao = minhas.pop(rng.randrange(len(minhas)))
+                    with trava:
+                        em_uso[locacao.veiculo.placa] -= 1
+                    sistema.devolver_veiculo(locacao, locacao.data_retirada)
+                    with trava:
+                        contagem['devolucoes'] += 1
+                    continue
+                with trava:
+                    retirada = pd.Timestamp('2024-01-01') + pd.Timedelta(next(sequencia), unit='min')
+                veiculo, cliente = rng.choice(veiculos), rng.choice(clientes)
+                try:
+                    locacao = sistema.alugar_veiculo(cliente, veiculo, retirada, retirada + pd.Timedelta(days=2),
+                                                     'a', 'b', None, distancia_km=10.0)
+                except ValueError:
+                    with trava:
+                        contagem['recusas'] += 1
+                    continue
+                preco_base, _ = locacao.calcular_preco_total()
+                with trava:
+                    em_uso[veiculo.placa] = em_uso.get(veiculo.placa, 0) + 1
+                    contagem['duplas'] += em_uso[veiculo.placa] > 1
+                    contagem['alugueis'] += 1
+                    contagem['pontos'] += int(preco_base // 10)
+                minhas.append(locacao)
+
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            threads = [threading.Thread(target=balcao, args=(i,)) for i in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        duracao = time.perf_counter() - inicio
+
+        sobreposicoes = contar_sobreposicoes(sistema.historico)
+        divergencias = sistema.agregados.conferir(sistema.repositorio, sistema.historico)
+        abertas_memoria = len(sistema.historico.listar_abertas())
+        alugados = sum(v.status == 'alugado' for v in veiculos)
+        pontos = sum(c.pontos_fidelidade for c in clientes)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            sistema.carregar_dados()
+        recarregado = (len(sistema.historico.listar_historico()), len(sistema.historico.listar_abertas()),
+                       sum(c.pontos_fidelidade for c in sistema.repositorio.listar_clientes()))
+
+    esperado = (contagem['alugueis'], contagem['alugueis'] - contagem['devolucoes'], contagem['pontos'])
+    return {
+        'armazenamento': tipo, 'threads': n_threads, 'segundos': round(duracao, 3), **contagem,
+        'sobreposicoes': sobreposicoes, 'divergencias': len(divergencias),
+        'ok': (contagem['duplas'] == 0 and sobreposicoes == 0 and not divergencias and abertas_memoria == alugados == esperado[1]
+               and pontos == esperado[2] and recarregado == esperado)
+    }
+
+# Um balcão em outro processo: aluga e devolve sobre o mesmo banco que os outros processos.
+# As retiradas de cada processo são distintas (índice + k * n_processos minutos depois da data base).
+def _balcao_processo(diretorio, tipo, indice, n_processos, n_operacoes, semente):
+    usar_banco(diretorio, tipo)
+    sistema.armazenamento.limite_journal = 50  # Compacta com frequência para exercitar a recarga
+    sistema.instrumentacao.ativa = True  # Conta as recargas feitas pelas próprias operações
+    rng = random.Random(semente + indice)
+    contagem = {'alugueis': 0, 'recusas': 0, 'devolucoes': 0, 'pontos': 0, 'recargas': 0, 'divergencias_locais': 0}
+    minhas = []  # (cpf, placa, retirada) das locações abertas por este processo
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        sistema.carregar_dados()
+        for k in range(n_operacoes):
+            try:
+                if minhas and rng.random() < 0.5:
+                    cpf, placa, retirada = minhas[rng.randrange(len(minhas))]
+                    locacao = next(l for l in sistema.historico.locacoes_do_veiculo(sistema.repositorio.buscar_veiculo(placa))
+                                   if l.cliente.cpf == cpf and l.data_retirada == retirada)
+                    sistema.devolver_veiculo(locacao, retirada)
+                    minhas.remove((cpf, placa, retirada))
+                    contagem['devolucoes'] += 1
+                    continue
+                retirada = pd.Timestamp('2024-01-01') + pd.Timedelta(indice + k * n_processos, unit='min')
+                veiculo = rng.choice(sistema.repositorio.listar_veiculos())
+                cliente = rng.choice(sistema.repositorio.listar_clientes())
+                try:
+                    locacao = sistema.alugar_veiculo(cliente, veiculo, retirada, retirada + pd.Timedelta(days=2),
+                                                     'a', 'b', None, distancia_km=10.0)
+                except ValueError:
+                    contagem['recusas'] += 1
+                    continue
+                contagem['alugueis'] += 1
+                contagem['pontos'] += int(locacao.calcular_preco_total()[0] // 10)
+                minhas.append((cliente.cpf, veiculo.placa, retirada))
+            except sistema.ErroConcorrencia:
+                # O banco mudou em todas as tentativas da operação: nada dela foi gravado; recarrega e segue
+                contagem['recargas'] += 1
+                sistema.carregar_dados()
+
+        # Traz para a memória o que os outros processos gravaram e confere os agregados, que foram
+        # mantidos só com as diferenças de cada alteração aplicada
+        try:
+            with sistema.exclusivo(*sistema.repositorio.listar_veiculos(), *sistema.repositorio.listar_clientes()):
+                pass
+        except sistema.ErroConcorrencia:
+            sistema.carregar_dados()
+        contagem['divergencias_locais'] = len(sistema.agregados.conferir(sistema.repositorio, sistema.historico))
+    contagem['recargas'] += sistema.instrumentacao.contadores['recargas']
+    return contagem
+
+# Teste de estresse entre processos: vários balcões (processos separados) alugam e devolvem os mesmos
+# veículos sobre o mesmo banco; no final, recarregado do disco, nada pode ter se perdido ou se sobreposto
+def testar_concorrencia_processos(n_processos=4, n_operacoes=150, n_veiculos=5, n_clientes=20, tipo='sqlite', semente=42):
+    with tempfile.TemporaryDirectory() as diretorio:
+        usar_banco(diretorio, tipo)
+        df_veiculos, df_clientes, _ = gerar_dados_sinteticos(n_veiculos, n_clientes, 0, semente)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            sistema.carregar_dados()
+            for registro in df_veiculos.to_dict('records'):
+                sistema.adicionar_veiculo(sistema.Veiculo(**registro))
+            for registro in df_clientes.to_dict('records'):
+                sistema.adicionar_cliente(sistema.Cliente(registro['nome'], registro['cpf'], registro['telefone'], registro['email']))
+            sistema.salvar_dados()
+
+        inicio = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(n_processos) as pool:
+            contagens = pool.starmap(_balcao_processo, [(diretorio, tipo, i, n_processos, n_operacoes, semente)
+                                                         for i in range(n_processos)])
+        duracao = time.perf_counter() - inicio
+        contagem = {chave: sum(c[chave] for c in contagens) for chave in contagens[0]}
+
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            sistema.carregar_dados()
+        sobreposicoes = contar_sobreposicoes(sistema.historico)
+        divergencias = sistema.agregados.conferir(sistema.repositorio, sistema.historico)
+        recarregado = (len(sistema.historico.listar_historico()), len(sistema.historico.listar_abertas()),
+                       sum(c.pontos_fidelidade for c in sistema.repositorio.listar_clientes()))
+
+    esperado = (contagem['alugueis'], contagem['alugueis'] - contagem['devolucoes'], contagem['pontos'])
+    return {
+        'armazenamento': tipo, 'processos': n_processos, 'segundos': round(duracao, 3), **contagem,
+        'sobreposicoes': sobreposicoes, 'divergencias': len(divergencias),
+        'ok': sobreposicoes == 0 and not divergencias and not contagem['divergencias_locais'] and recarregado == esperado
+    }
+
+# Servidor local que imita a API Distance Matrix, com atraso e taxa de falhas configuráveis
+def iniciar_servidor_falso(atraso=0.02, taxa_falhas=0.0):
+    class Manipulador(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Mantém a conexão aberta entre requisições (keep-alive)
+
+        def setup(self):
+            super().setup()
+            # Cabeçalho e corpo saem em escritas separadas; sem isso o Nagle soma ~40 ms por resposta
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_GET(self):
+            time.sleep(atraso * random.uniform(0.5, 1.5))
+            if random.random() < taxa_falhas:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            consulta = parse_qs(urlparse(self.path).query)
+            origens = consulta['origins'][0].split('|')
+            destinos = consulta['destinations'][0].split('|')
+            corpo = json.dumps({'status': 'OK', 'rows': [
+                {'elements': [{'status': 'OK', 'distance': {'value': 1000 * (len(o) + len(d))}} for d in destinos]}
+                for o in origens]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manipulador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}/distancematrix/json'
+
+# Mede a latência (p50/p95/p99) do cliente de distâncias contra o servidor falso,
+# em sequência e com consultas concorrentes via asyncio
+def medir_latencia_distancias(n_consultas=200, concorrencia=20, atraso=0.02, taxa_falhas=0.05):
+    servidor, url = iniciar_servidor_falso(atraso, taxa_falhas)
+    resultados = []
+    try:
+        for modo in ('sequencial', 'assíncrono'):
+            cliente = sistema.ClienteDistancia(url=url, espera_base=0.01, tamanho_pool=concorrencia)
+            pares = [([f'Origem {i}'], [f'Destino {i}']) for i in range(n_consultas)]
+
+            inicio = time.perf_counter()
+            if modo == 'sequencial':
+                for origens, destinos in pares:
+                    cliente.consultar(origens, destinos, 'chave')
+            else:
+                async def consultar_todos():
+                    semaforo = asyncio.Semaphore(concorrencia)
+
+                    async def consultar(origens, destinos):
+                        async with semaforo:
+                            return await cliente.consultar_async(origens, destinos, 'chave')
+
+                    await asyncio.gather(*(consultar(o, d) for o, d in pares))
+                asyncio.run(consultar_todos())
+            duracao = time.perf_counter() - inicio
+
+            resultados.append({'modo': modo, 'consultas': n_consultas, 'segundos': round(duracao, 3),
+                               **{p: round(v * 1000, 2) for p, v in cliente.percentis().items()}})
+    finally:
+        servidor.shutdown()
+    return pd.DataFrame(resultados)
+
+# Operações medidas pela suíte de desempenho (nomes registrados pela instrumentação do sistema)
+OPERACOES_SUITE = ('carregar_dados', 'buscar_veiculos', 'buscar_locacoes', 'alugar_veiculo', 'devolver_veiculo',
+                   'salvar_dados')
+
+# Substitui a consulta de distância por uma distância fixa, sem acessar a rede
+@contextlib.contextmanager
+def distancia_fixa(distancia_km=100.0):
+    original = sistema.calcular_distancia_e_custo
+
+    def calcular(origem, destino, chave_api, taxa_por_km=0.50, modo='driving'):
+        return distancia_km, distancia_km * taxa_por_km
+
+    sistema.calcular_distancia_e_custo = calcular
+    try:
+        yield
+    finally:
+        sistema.calcular_distancia_e_custo = original
+
+# Suíte de desempenho: para cada tamanho de histórico gera um banco sintético e mede, pela instrumentação
+# do sistema, carregar_dados, buscar_veiculos, buscar_locacoes, alugar_veiculo (com a distância fixa),
+# devolver_veiculo e salvar_dados. Retorna os tempos por operação e os contadores (bytes gravados etc.).
+def executar_suite(tamanhos, tipo='excel', n_veiculos=500, n_clientes=2000, n_operacoes=200, repeticoes=3, semente=42):
+    instrumentacao = sistema.instrumentacao
+    ativa = instrumentacao.ativa
+    instrumentacao.ativa = True
+    tempos, contadores = [], []
+    try:
+        for n_locacoes in tamanhos:
+            with tempfile.TemporaryDirectory() as diretorio:
+                usar_banco(diretorio)
+                gravar_banco_sintetico(sistema.armazenamento.arquivo, n_veiculos, n_clientes, n_locacoes, semente)
+                if tipo == 'sqlite':
+                    sistema.migrar_excel_para_sqlite(sistema.armazenamento.arquivo,
+                                                     os.path.join(diretorio, 'banco de dados.sqlite'),
+                                                     sistema.armazenamento.journal)
+                    usar_banco(diretorio, tipo)
+                instrumentacao.zerar()
+                rng = random.Random(semente)
+
+                with contextlib.redirect_stdout(open(os.devnull, 'w')), distancia_fixa():
+                    for _ in range(repeticoes):
+                        sistema.carregar_dados()
+
+                    cpf = sistema.repositorio.listar_clientes()[0].cpf
+                    for _ in range(repeticoes):
+                        sistema.buscar_veiculos(tipo='carro', status='disponível')
+                        sistema.buscar_veiculos(categoria='Premium', ordenar_por='ano')
+                        sistema.buscar_locacoes(tipo_veiculo='moto', data_inicio=pd.Timestamp('2020-01-01'),
+                                                data_fim=pd.Timestamp('2020-12-31'))
+                        sistema.buscar_locacoes(cpf_cliente=cpf, ordenar_por='Data Retirada')
+
+                    # Reservas futuras em rodízio pela frota: o mesmo veículo volta a cada 3 dias, sem sobreposição
+                    veiculos = sistema.repositorio.listar_veiculos()
+                    clientes = sistema.repositorio.listar_clientes()
+                    locacoes = []
+                    for i in range(n_operacoes):
+                        retirada = pd.Timestamp('2030-01-01') + pd.Timedelta(days=3 * (i // len(veiculos)))
+                        locacoes.append(sistema.alugar_veiculo(rng.choice(clientes), veiculos[i % len(veiculos)],
+                                                               retirada, retirada + pd.Timedelta(days=2),
+                                                               'Origem', 'Destino', None))
+                    for locacao in locacoes:
+                        sistema.devolver_veiculo(locacao, locacao.data_devolucao_prevista + pd.Timedelta(days=1))
+
+                    for _ in range(repeticoes):
+                        sistema.salvar_dados()
+
+                resumo = instrumentacao.resumo()
+
+            for operacao in OPERACOES_SUITE:
+                tempo = resumo['tempos'][operacao]
+                tempos.append({'armazenamento': tipo, 'locacoes': n_locacoes, 'operacao': operacao,
+                               'chamadas': tempo['chamadas'], 'media_ms': round(tempo['media_ms'], 3),
+                               'p95_ms': round(tempo['p95_ms'], 3), 'max_ms': round(tempo['max_ms'], 3)})
+            contadores.append({'armazenamento': tipo, 'locacoes': n_locacoes, **resumo['contadores']})
+    finally:
+        instrumentacao.ativa = ativa
+        instrumentacao.zerar()
+    return {'tempos': tempos, 'contadores': contadores}
+
+# Versão do código medida (commit do git, quando disponível)
+def versao_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Grava os resultados da suíte em JSON, com a versão e o ambiente, para comparar entre versões
+def gravar_resultados(resultados, caminho, parametros):
+    documento = {
+        'versao': versao_atual(),
+        'data': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': parametros,
+        **resultados
+    }
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(documento, arquivo, ensure_ascii=False, indent=2)
+
+# Compara a média de cada operação com a de um arquivo de resultados anterior
+def comparar_resultados(resultados, caminho_anterior):
+    with open(caminho_anterior, encoding='utf-8') as arquivo:
+        anterior = json.load(arquivo)
+    chaves = ['armazenamento', 'locacoes', 'operacao']
+    df = pd.DataFrame(resultados['tempos'])[chaves + ['media_ms']].merge(
+        pd.DataFrame(anterior['tempos'])[chaves + ['media_ms']], on=chaves, suffixes=('', '_anterior'))
+    df['variacao_%'] = ((df['media_ms'] / df['media_ms_anterior'] - 1) * 100).round(1)
+    return df, anterior.get('versao')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do sistema de locação de veículos")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help="Tamanhos do histórico de locações a medir")
+    parser.add_argument('--armazenamento', action='store_true',
+                        help="Compara os armazenamentos Excel e SQLite")
+    parser.add_argument('--memoria', action='store_true',
+                        help="Mede os bytes por registro de veículos, clientes e locações")
+    parser.add_argument('--precificacao', action='store_true',
+                        help="Compara a precificação objeto a objeto com a precificação em lote")
+    parser.add_argument('--disponibilidade', action='store_true',
+                        help="Mede a consulta de veículos livres em um período")
+    parser.add_argument('--concorrencia', action='store_true',
+                        help="Executa o teste de estresse de locações concorrentes")
+    parser.add_argument('--distancias', action='store_true',
+                        help="Mede também a latência do cliente de distâncias contra um servidor local")
+    parser.add_argument('--suite', action='store_true',
+                        help="Executa a suíte de desempenho (carregar, buscar, alugar, devolver e salvar)")
+    parser.add_argument('--tipo', choices=['excel', 'sqlite'], default=sistema.ARMAZENAMENTO,
+                        help="Armazenamento usado pela suíte")
+    parser.add_argument('--operacoes', type=int, default=200,
+                        help="Quantidade de locações e devoluções feitas pela suíte")
+    parser.add_argument('--saida', default='resultados do benchmark.json',
+                        help="Arquivo JSON onde a suíte grava os resultados")
+    parser.add_argument('--comparar', help="Arquivo JSON de uma execução anterior da suíte para comparação")
+    args = parser.parse_args()
+
+    print("\nTempo de carregamento por tamanho do histórico:")
+    print(medir_carregamento(args.tamanhos).to_string(index=False))
+
+    if args.armazenamento:
+        print("\nArmazenamento Excel x SQLite:")
+        print(medir_armazenamento(args.tamanhos).to_string(index=False))
+
+    if args.memoria:
+        print("\nMemória por registro (antes: objetos com __dict__ e Timestamps):")
+        print(medir_memoria().to_string(index=False))
+
+    if args.precificacao:
+        print("\nPrecificação objeto a objeto x em lote:")
+        print(medir_precificacao(args.tamanhos).to_string(index=False))
+
+    if args.disponibilidade:
+        print("\nConsulta de veículos livres em um período:")
+        print(medir_disponibilidade(args.tamanhos).to_string(index=False))
+
+    falhas = []
+    if args.concorrencia:
+        print("\nLocações concorrentes entre threads (nenhuma dupla locação e nada perdido):")
+        df_threads = pd.DataFrame([testar_concorrencia(tipo=tipo) for tipo in ('excel', 'sqlite')])
+        print(df_threads.to_string(index=False))
+        print("\nLocações concorrentes entre processos (mesmo banco em disco):")
+        df_processos = pd.DataFrame([testar_concorrencia_processos(tipo=tipo) for tipo in ('excel', 'sqlite')])
+        print(df_processos.to_string(index=False))
+        falhas += [f"concorrência entre threads ({tipo})" for tipo in df_threads.loc[~df_threads['ok'], 'armazenamento']]
+        falhas += [f"concorrência entre processos ({tipo})" for tipo in df_processos.loc[~df_processos['ok'], 'armazenamento']]
+
+    if args.distancias:
+        print("\nLatência do cliente de distâncias (ms por chamada HTTP):")
+        print(medir_latencia_distancias().to_string(index=False))
+
+    if args.suite:
+        resultados = executar_suite(args.tamanhos, args.tipo, n_operacoes=args.operacoes)
+        print(f"\nSuíte de desempenho ({args.tipo}):")
+        print(pd.DataFrame(resultados['tempos']).to_string(index=False))
+        print("\nContadores da instrumentação:")
+        print(pd.DataFrame(resultados['contadores']).to_string(index=False))
+        gravar_resultados(resultados, args.saida, {'tamanhos': args.tamanhos, 'tipo': args.tipo,
+                                                   'operacoes': args.operacoes})
+        print(f"\nResultados gravados em {args.saida}.")
+        if args.comparar:
+            comparacao, versao = comparar_resultados(resultados, args.comparar)
+            print(f"\nComparação com a versão {versao or 'anterior'}:")
+            print(comparacao.to_string(index=False))
+
+    if falhas:
+        print(f"\nFALHA: {', '.join(falhas)}")
+        sys.exit(1)